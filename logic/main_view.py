@@ -2,6 +2,7 @@ from PySide6 import QtWidgets, QtCore
 from loguru import logger
 from ui.main_window import Ui_Form
 from scopus.scopus_spider import ScopusSpider
+from scopus.scopus_browser import BrowserPool
 import os
 
 
@@ -15,8 +16,11 @@ class MainView(QtWidgets.QWidget, Ui_Form):
         self.password.setText("WANGyezhu123")
         self.work_path.setText(os.path.dirname(os.path.realpath(__file__)))
         self.search.setPlainText("SOURCE-ID ( \"21121\" )  AND  ( LIMIT-TO ( DOCTYPE ,  \"ar\" ) )  AND  ( LIMIT-TO ( PUBYEAR ,  2015 ) )  AND  ( LIMIT-TO ( AFFILCOUNTRY ,  \"China\" ) ) ")
+        # 浏览器用完不关闭, 再次点开始时直接复用已登录的浏览器
+        self.browser_pool = BrowserPool(os.path.join(self.work_path.text(), "browsers"), self.username.text(),
+                                        self.password.text(), size=1)
         self.spider = ScopusSpider(self.work_path.text(), self.search.toPlainText(), self.username.text(),
-                                   self.password.text())
+                                   self.password.text(), browser_pool=self.browser_pool)
         # 信号-槽
         self.start_btn.clicked.connect(self.start)
         self.resolve_data_btn.clicked.connect(self.resolve_data_clicked)
@@ -38,6 +42,10 @@ class MainView(QtWidgets.QWidget, Ui_Form):
             self.spider.stop()
             self.start_btn.setText("开始")
 
+    def closeEvent(self, event):
+        self.browser_pool.close()
+        super().closeEvent(event)
+
     def resolve_data_clicked(self):
         self.spider.resolve_data_clicked()
 
@@ -0,0 +1,147 @@
+"""
+浏览器池: 预先启动并登录若干个chrome, 按需借给spider或批量任务, 用完归还而不是关闭,
+连续运行时不用再等chrome启动和登录; 每个浏览器使用单独的用户目录, 翻页数超过max_pages后重启以控制内存
+"""
+import os
+import queue
+import threading
+import traceback
+from contextlib import contextmanager
+
+from scopus.scopus_spider import ScopusSpider
+
+
+class Lease(object):
+    """
+    一次租借: driver为已登录的浏览器, pages为本次租借期间打开的结果页数
+    """
+    def __init__(self, slot):
+        self.slot = slot
+        self.driver = slot.driver
+        self.pages = 0
+
+
+class BrowserPool(object):
+    """
+    work_path下每个浏览器一个browser_<i>目录, 其中tmp/chrome_profile为该浏览器的用户目录, tmp/session.json为登录状态
+    """
+    def __init__(self, work_path, username, password, size=2, max_pages=200, profile="default", warm=True):
+        self.work_path = work_path
+        self.username = username
+        self.password = password
+        self.size = size
+        self.max_pages = max_pages
+        if not os.path.exists(work_path):
+            os.makedirs(work_path)
+        # 每个名额用一个不爬数据的spider持有driver, 复用它的启动参数和登录流程
+        self.slots = [ScopusSpider(os.path.join(work_path, "browser_" + str(i)), "", username, password,
+                                   profile=profile, cache_dir=False) for i in range(size)]
+        for slot in self.slots:
+            slot.pages = 0
+        self.idle = queue.Queue()
+        for slot in self.slots:
+            self.idle.put(slot)
+        self.lock = threading.Lock()
+        self.warm_lock = threading.Lock()
+        self.closed = False
+        # 创建后就在后台启动并登录, 第一次租借时不用再等
+        if warm:
+            threading.Thread(target=self.warm, daemon=True).start()
+
+    # 并行启动并登录所有空闲且还没启动(或已不可用)的浏览器; 后台预热还没结束时等它完成
+    def warm(self):
+        with self.warm_lock:
+            slots = list()
+            for _ in range(self.idle.qsize()):
+                try:
+                    slot = self.idle.get_nowait()
+                except queue.Empty:
+                    break
+                if self.healthy(slot):
+                    self.idle.put(slot)
+                else:
+                    slots.append(slot)
+            threads = [threading.Thread(target=self.restart, args=(slot,), daemon=True) for slot in slots]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        return self
+
+    def start_slot(self, slot):
+        slot.start_driver()
+        slot.login()
+        slot.pages = 0
+
+    # 重启一个浏览器后放回空闲队列, 启动失败时也放回, 下次租借时再试
+    def restart(self, slot):
+        slot.release_driver()
+        try:
+            if not self.closed:
+                self.start_slot(slot)
+            # 启动过程中池被关闭了
+            if self.closed:
+                slot.release_driver()
+        except Exception:
+            traceback.print_exc()
+            slot.release_driver()
+        self.idle.put(slot)
+
+    @staticmethod
+    def healthy(slot):
+        if slot.driver is None:
+            return False
+        try:
+            return slot.driver.execute_script("return 1") == 1
+        except Exception:
+            return False
+
+    # 当前空闲的浏览器数
+    def available(self):
+        return self.idle.qsize()
+
+    # 借出一个已登录且能响应的浏览器, timeout秒内没有空闲浏览器时抛出queue.Empty
+    def acquire(self, timeout=None):
+        slot = self.idle.get(timeout=timeout)
+        try:
+            if not self.healthy(slot):
+                print("浏览器" + slot.work_path + "不可用, 重新启动")
+                slot.release_driver()
+                self.start_slot(slot)
+        except Exception:
+            slot.release_driver()
+            self.idle.put(slot)
+            raise
+        return Lease(slot)
+
+    # 归还浏览器; broken为True或累计翻页数超过max_pages时在后台重启, 重启完成后才能再被借出
+    def release(self, lease, broken=False):
+        slot = lease.slot
+        slot.pages += lease.pages
+        if self.closed:
+            slot.release_driver()
+            return
+        if broken or slot.pages >= self.max_pages:
+            print("重启浏览器" + slot.work_path + ", 已翻页" + str(slot.pages))
+            threading.Thread(target=self.restart, args=(slot,), daemon=True).start()
+            return
+        self.idle.put(slot)
+
+    @contextmanager
+    def lease(self, timeout=None):
+        lease = self.acquire(timeout)
+        broken = False
+        try:
+            yield lease
+        except Exception:
+            broken = not self.healthy(lease.slot)
+            raise
+        finally:
+            self.release(lease, broken)
+
+    def close(self):
+        self.closed = True
+        for slot in self.slots:
+            slot.release_driver()
+            slot.close_http()
+            slot.store.close()
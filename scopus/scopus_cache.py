@@ -0,0 +1,95 @@
+import hashlib
+import os
+import pickle
+import threading
+import time
+import zlib
+from collections import Counter
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
+
+DAY = 24 * 3600
+# 各host的缓存有效期(秒)
+DEFAULT_TTLS = {
+    "api.scopus.com": 30 * DAY,
+    "plu.mx": 7 * DAY,
+}
+
+
+# host小写, 去掉默认端口和#片段, query参数排序, 保证同一资源只对应一个key
+def normalize_url(url):
+    parts = urlparse(url.strip())
+    netloc = parts.netloc.lower()
+    if (parts.scheme == "https" and netloc.endswith(":443")) or (parts.scheme == "http" and netloc.endswith(":80")):
+        netloc = netloc.rsplit(":", 1)[0]
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunparse((parts.scheme.lower(), netloc, parts.path or "/", "", query, ""))
+
+
+class ResponseCache(object):
+    """
+    按URL内容寻址的磁盘响应缓存, 响应体压缩存储, 各host单独设置有效期
+    """
+    def __init__(self, cache_dir, ttls=None, default_ttl=DAY):
+        self.cache_dir = cache_dir
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.default_ttl = default_ttl
+        self.counters = Counter()
+        self.lock = threading.Lock()
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def path(self, url):
+        key = hashlib.sha256(normalize_url(url).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key + ".z")
+
+    def ttl(self, url):
+        return self.ttls.get(urlparse(url).netloc.lower(), self.default_ttl)
+
+    def count(self, key):
+        with self.lock:
+            self.counters[key] += 1
+
+    # 读取完整缓存条目{"url", "time", "headers", "body"}, 不检查有效期
+    def load(self, url):
+        p = self.path(url)
+        try:
+            with open(p, "rb") as f:
+                return pickle.loads(zlib.decompress(f.read()))
+        except (OSError, zlib.error, pickle.UnpicklingError, EOFError):
+            return None
+
+    # 返回未过期的响应体(bytes), 没有或已过期返回None
+    def get(self, url):
+        entry = self.load(url)
+        if entry is None:
+            self.count("misses")
+            return None
+        if time.time() - entry["time"] > self.ttl(url):
+            self.count("expired")
+            return None
+        self.count("hits")
+        return entry["body"]
+
+    def put(self, url, body, headers=None):
+        p = self.path(url)
+        if not os.path.exists(os.path.dirname(p)):
+            os.makedirs(os.path.dirname(p), exist_ok=True)
+        entry = {"url": normalize_url(url), "time": time.time(), "headers": dict(headers or {}), "body": body}
+        tmp = p + "." + str(os.getpid()) + "-" + str(threading.get_ident()) + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(zlib.compress(pickle.dumps(entry)))
+        os.replace(tmp, p)
+        self.count("stores")
+
+    def delete(self, url):
+        try:
+            os.remove(self.path(url))
+        except OSError:
+            pass
+
+    def stats(self):
+        with self.lock:
+            result = dict(self.counters)
+        lookups = result.get("hits", 0) + result.get("misses", 0) + result.get("expired", 0)
+        result["hit_rate"] = result.get("hits", 0) / lookups if lookups else 0.0
+        return result
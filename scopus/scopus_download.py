@@ -0,0 +1,62 @@
+import glob
+import os
+import time
+
+
+class DownloadWatcher(object):
+    """
+    监视下载目录: chrome下载时先写xxx.crdownload, 完成后才改名为scopus.csv;
+    改名完成、文件大小不再变化且表头里有EID列时视为下载完成
+    """
+    def __init__(self, download_path, filename="scopus.csv", timeout=600, poll=0.5, stable_checks=2):
+        self.download_path = download_path
+        self.filename = filename
+        self.timeout = timeout
+        self.poll = poll
+        self.stable_checks = stable_checks
+        self.encoding = "utf-8"
+        self.path = None
+
+    @property
+    def target(self):
+        return os.path.join(self.download_path, self.filename)
+
+    def downloading(self):
+        return len(glob.glob(os.path.join(self.download_path, "*.crdownload"))) > 0
+
+    # 等待下载完成, 返回文件路径; 超时或cancel()返回True时返回None
+    def wait(self, timeout=None, cancel=None):
+        if self.path is not None:
+            return self.path
+        deadline = time.time() + (self.timeout if timeout is None else timeout)
+        last_size = -1
+        stable = 0
+        while time.time() < deadline:
+            if cancel is not None and cancel():
+                return None
+            if os.path.exists(self.target) and not self.downloading():
+                size = os.path.getsize(self.target)
+                stable = stable + 1 if size == last_size else 0
+                last_size = size
+                if stable >= self.stable_checks and self.validate():
+                    self.path = self.target
+                    return self.path
+            time.sleep(self.poll)
+        print("等待" + self.filename + "下载超时")
+        return None
+
+    # 表头有EID列且至少有一行数据
+    def validate(self):
+        for encoding in ["utf-8-sig", "gbk"]:
+            try:
+                with open(self.target, encoding=encoding) as f:
+                    header = f.readline()
+                    first = f.readline()
+            except UnicodeDecodeError:
+                continue
+            columns = [c.strip().strip("\"") for c in header.split(",")]
+            if "EID" not in columns or first.strip() == "":
+                return False
+            self.encoding = encoding
+            return True
+        return False
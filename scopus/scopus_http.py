@@ -0,0 +1,328 @@
+import random
+import threading
+import time
+import traceback
+from collections import Counter
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_HEADERS = {
+    "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/92.0.4515.131 Safari/537.36",
+}
+# 每秒请求数
+DEFAULT_RATES = {
+    "api.scopus.com": 5.0,
+    "plu.mx": 5.0,
+}
+
+
+class FetchError(Exception):
+    pass
+
+
+class CircuitOpenError(FetchError):
+    pass
+
+
+class RetryPolicy(object):
+    """
+    有上限的指数退避 + 随机抖动, 超过max_attempts次后放弃
+    """
+    def __init__(self, max_attempts=6, base_delay=1.0, max_delay=60.0, jitter=0.5, retry_status=(500, 502, 503, 504)):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.retry_status = set(retry_status)
+
+    # attempt从0开始
+    def delay(self, attempt):
+        d = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return d * random.uniform(1 - self.jitter, 1)
+
+
+class CircuitBreaker(object):
+    """
+    按host熔断: 连续失败failure_threshold次后打开, reset_timeout秒内直接失败, 之后放行一个试探请求(半开)
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = dict()
+        self.opened_at = dict()
+        self.probing = set()
+        self.lock = threading.Lock()
+
+    def allow(self, host):
+        with self.lock:
+            opened_at = self.opened_at.get(host)
+            if opened_at is None:
+                return True
+            if time.time() - opened_at < self.reset_timeout or host in self.probing:
+                return False
+            self.probing.add(host)
+            return True
+
+    def record_success(self, host):
+        with self.lock:
+            self.failures[host] = 0
+            self.opened_at.pop(host, None)
+            self.probing.discard(host)
+
+    # 返回True表示本次失败使熔断器打开
+    def record_failure(self, host):
+        with self.lock:
+            self.failures[host] = self.failures.get(host, 0) + 1
+            was_probing = host in self.probing
+            self.probing.discard(host)
+            if was_probing or self.failures[host] >= self.failure_threshold:
+                self.opened_at[host] = time.time()
+                return True
+            return False
+
+    # 距离可以放行试探请求还有多少秒, 未熔断时为0
+    def remaining(self, host):
+        with self.lock:
+            opened_at = self.opened_at.get(host)
+            if opened_at is None:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.time() - opened_at))
+
+    def state(self, host):
+        with self.lock:
+            if host not in self.opened_at:
+                return "closed"
+            if host in self.probing or time.time() - self.opened_at[host] >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+
+class TokenBucket(object):
+    def __init__(self, rate, capacity=None):
+        self.base_rate = float(rate)
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    # 返回还需等待的秒数, 0表示已拿到令牌
+    def take(self):
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter(object):
+    """
+    按host的令牌桶限速, 多个worker共享; 收到429/Retry-After时暂停该host并降速, 之后随成功请求逐步恢复
+    """
+    def __init__(self, rates=None, default_rate=5.0, min_rate=0.2, backoff_factor=0.5, recover_step=0.1):
+        self.rates = dict(DEFAULT_RATES if rates is None else rates)
+        self.default_rate = default_rate
+        self.min_rate = min_rate
+        self.backoff_factor = backoff_factor
+        self.recover_step = recover_step
+        self.buckets = dict()
+        self.lock = threading.Lock()
+
+    def bucket(self, host):
+        b = self.buckets.get(host)
+        if b is None:
+            b = TokenBucket(self.rates.get(host, self.default_rate))
+            self.buckets[host] = b
+        return b
+
+    def acquire(self, host):
+        while True:
+            with self.lock:
+                wait = self.bucket(host).take()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def throttle(self, host, retry_after=None):
+        with self.lock:
+            b = self.bucket(host)
+            b.rate = max(self.min_rate, b.rate * self.backoff_factor)
+            b.tokens = 0.0
+            if retry_after:
+                b.blocked_until = max(b.blocked_until, time.monotonic() + retry_after)
+
+    def record_success(self, host):
+        with self.lock:
+            b = self.bucket(host)
+            if b.rate < b.base_rate:
+                b.rate = min(b.base_rate, b.rate + self.recover_step)
+
+    def current_rates(self):
+        with self.lock:
+            return {host: b.rate for host, b in self.buckets.items()}
+
+
+# Retry-After可能是秒数, 也可能是HTTP日期
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class SessionPool(object):
+    """
+    按host复用的keep-alive会话池, 整个爬取过程由spider持有;
+    熔断期间请求最多等待open_wait秒(等到半开再试), 而不是立即失败, open_wait=0时立即抛出CircuitOpenError
+    """
+    def __init__(self, pool_size=10, keep_alive=True, headers=None, proxies=None, verify=False, timeout=5,
+                 retry_policy=None, breaker=None, limiter=None, telemetry=None, open_wait=600.0):
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.headers = dict(DEFAULT_HEADERS if headers is None else headers)
+        if not keep_alive:
+            self.headers["connection"] = "close"
+        self.proxies = proxies
+        self.verify = verify
+        self.timeout = timeout
+        self.sessions = dict()
+        self.cookies = dict()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.limiter = limiter or RateLimiter()
+        self.open_wait = open_wait
+        # 可选的Telemetry, 记录每个host的请求延迟和错误
+        self.telemetry = telemetry
+        # 请求/重试/熔断计数, 通过stats()读取
+        self.counters = Counter()
+        self.lock = threading.Lock()
+
+    def session(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            s = self.sessions.get(host)
+            if s is None:
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                s.headers.update(self.headers)
+                s.cookies.update(self.cookies)
+                if self.proxies:
+                    s.proxies.update(self.proxies)
+                s.verify = self.verify
+                self.sessions[host] = s
+        return s
+
+    # cookies可以是dict, 也可以是selenium driver.get_cookies()返回的list, 只有发生变化时才刷新
+    def update_cookies(self, cookies):
+        if isinstance(cookies, list):
+            cookies = {c["name"]: c["value"] for c in cookies}
+        if not cookies or cookies == self.cookies:
+            return False
+        with self.lock:
+            self.cookies = dict(cookies)
+            for s in self.sessions.values():
+                s.cookies.clear()
+                s.cookies.update(self.cookies)
+        return True
+
+    def get(self, url, cookies=None, **kwargs):
+        if cookies:
+            self.update_cookies(cookies)
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session(url).get(url, **kwargs)
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.counters[key] += n
+
+    def record_error(self, host, kind):
+        if self.telemetry is not None:
+            self.telemetry.error(host, kind)
+
+    def stats(self):
+        with self.lock:
+            result = dict(self.counters)
+        result["breakers"] = {host: self.breaker.state(host) for host in list(self.sessions.keys())}
+        result["rates"] = self.limiter.current_rates()
+        return result
+
+    # 带重试和熔断的请求, 全部尝试失败或host处于熔断状态时抛出FetchError
+    def fetch(self, url, cookies=None, **kwargs):
+        host = urlparse(url).netloc
+        policy = self.retry_policy
+        attempt = 0
+        wait_until = None
+        while True:
+            if not self.breaker.allow(host):
+                if wait_until is None:
+                    wait_until = time.time() + self.open_wait
+                    self.count("breaker_wait")
+                if time.time() >= wait_until:
+                    self.count("fast_fail")
+                    self.record_error(host, "fast_fail")
+                    raise CircuitOpenError("熔断中, 跳过请求:" + url)
+                # 等到半开; 已有试探请求在途时隔一会儿再看结果
+                time.sleep(min(1.0, self.breaker.remaining(host)) or 0.5)
+                continue
+            wait_until = None
+            self.limiter.acquire(host)
+            self.count("requests")
+            t = time.perf_counter()
+            try:
+                r = self.get(url, cookies, **kwargs)
+            except Exception:
+                r = None
+                traceback.print_exc()
+                self.record_error(host, "exception")
+            if self.telemetry is not None and r is not None:
+                self.telemetry.observe_latency(host, time.perf_counter() - t)
+            if r is not None and (r.status_code == 429 or (r.status_code == 503 and "Retry-After" in r.headers)):
+                # 被限流说明host可用, 不计入熔断
+                self.breaker.record_success(host)
+                retry_after = parse_retry_after(r.headers.get("Retry-After"))
+                self.limiter.throttle(host, retry_after)
+                self.count("throttled")
+                self.record_error(host, "throttled")
+                print("被限流(" + str(r.status_code) + "), 降速后重试:" + url)
+                attempt += 1
+                if attempt >= policy.max_attempts:
+                    self.count("gave_up")
+                    raise FetchError("限流重试" + str(attempt) + "次后放弃:" + url)
+                continue
+            if r is not None and r.status_code not in policy.retry_status:
+                self.breaker.record_success(host)
+                self.limiter.record_success(host)
+                return r
+            if r is not None:
+                print("状态码" + str(r.status_code) + ":" + url)
+                self.record_error(host, "status_" + str(r.status_code))
+            self.count("failures")
+            if self.breaker.record_failure(host):
+                self.count("breaker_open")
+            attempt += 1
+            if attempt >= policy.max_attempts:
+                self.count("gave_up")
+                raise FetchError("重试" + str(attempt) + "次后放弃:" + url)
+            self.count("retries")
+            time.sleep(policy.delay(attempt - 1))
+
+    def close(self):
+        with self.lock:
+            for s in self.sessions.values():
+                s.close()
+            self.sessions = dict()
@@ -0,0 +1,149 @@
+"""
+批量任务: 从清单读取多组(query, work_path)并发爬取, 所有任务共用一个浏览器池、一个http连接池和一个限速器,
+每个任务各自的断点库和翻页游标保证可以随时中断续爬
+"""
+import json
+import os
+import sys
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from scopus.scopus_browser import BrowserPool
+from scopus.scopus_http import SessionPool, RateLimiter
+from scopus.scopus_spider import ScopusSpider
+from scopus.scopus_store import CheckpointStore
+from scopus.scopus_telemetry import Telemetry
+
+
+# 清单可以是json([{"query": ..., "work_path": ...}, ...]), 也可以是带query, work_path列的csv;
+# 可选的mode列为"crawl"(默认, 翻页爬取)或"csv"(从work_path/tmp/scopus.csv只爬指标)
+def read_manifest(path):
+    if path.lower().endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            jobs = json.load(f)
+    else:
+        jobs = pd.read_csv(path, dtype=str).fillna("").to_dict("records")
+    result = list()
+    for job in jobs:
+        job = dict(job)
+        job["query"] = job.get("query", "").strip()
+        job["work_path"] = os.path.abspath(job["work_path"])
+        job["mode"] = job.get("mode") or "crawl"
+        result.append(job)
+    return result
+
+
+# work_path/finish为手动标记; tmp/finish还要求断点库里的条数达到游标记录的总条数
+def job_finished(work_path):
+    if os.path.exists(os.path.join(work_path, "finish")):
+        return True
+    db = os.path.join(work_path, "tmp", "checkpoint.db")
+    if not os.path.exists(os.path.join(work_path, "tmp", "finish")) or not os.path.exists(db):
+        return False
+    store = CheckpointStore(db)
+    try:
+        cursor = store.load_cursor()
+        return cursor is not None and len(store) >= cursor["total"]
+    finally:
+        store.close()
+
+
+class JobRunner(object):
+    def __init__(self, jobs, username, password, max_jobs=4, browsers=2, max_workers=10, rates=None, browser_path=None,
+                 max_pages=200, **spider_kwargs):
+        self.jobs = jobs
+        self.username = username
+        self.password = password
+        self.max_jobs = max_jobs
+        self.max_workers = max_workers
+        self.spider_kwargs = spider_kwargs
+        # 任务之间轮流使用browsers个已登录的浏览器, 浏览器目录默认放在第一个任务目录旁边的browsers下
+        if browser_path is None:
+            browser_path = os.path.join(os.path.dirname(jobs[0]["work_path"]) if jobs else os.getcwd(), "browsers")
+        self.browser_pool = BrowserPool(browser_path, username, password, size=browsers, max_pages=max_pages,
+                                        profile=spider_kwargs.get("profile", "default"))
+        self.telemetry = Telemetry()
+        # 所有任务的请求都经过这一个连接池和限速器, 总请求速率不会因为任务数增加而超出限制
+        self.http = SessionPool(pool_size=max_workers * max_jobs, telemetry=self.telemetry,
+                                limiter=RateLimiter(rates))
+        self.spiders = dict()
+        self.states = {job["work_path"]: "pending" for job in jobs}
+        self.lock = threading.Lock()
+        self.go = True
+
+    def create_spider(self, job):
+        return ScopusSpider(job["work_path"], job["query"], self.username, self.password,
+                            max_workers=self.max_workers, http=self.http, browser_pool=self.browser_pool,
+                            **self.spider_kwargs)
+
+    def run_job(self, job):
+        work_path = job["work_path"]
+        if job_finished(work_path):
+            self.set_state(work_path, "finished")
+            return
+        if not self.go:
+            return
+        self.set_state(work_path, "running")
+        spider = None
+        try:
+            spider = self.create_spider(job)
+            with self.lock:
+                self.spiders[work_path] = spider
+            if job["mode"] == "csv":
+                spider.run_from_csv()
+            else:
+                spider.run()
+            self.set_state(work_path, "finished")
+        except Exception:
+            traceback.print_exc()
+            # 出错时浏览器可能停在任意页面, 归还后由池重启
+            if spider is not None:
+                spider.release_driver(broken=True)
+            self.set_state(work_path, "failed")
+
+    def set_state(self, work_path, state):
+        with self.lock:
+            self.states[work_path] = state
+        print("任务" + work_path + ": " + state)
+
+    def run(self):
+        with ThreadPoolExecutor(max_workers=self.max_jobs) as executor:
+            list(executor.map(self.run_job, self.jobs))
+        self.http.close()
+        self.browser_pool.close()
+        return self.progress()
+
+    def stop(self):
+        self.go = False
+        with self.lock:
+            spiders = list(self.spiders.values())
+        for spider in spiders:
+            spider.stop()
+
+    # 每个任务的状态和完成条数
+    def progress(self):
+        result = dict()
+        with self.lock:
+            items = list(self.states.items())
+            spiders = dict(self.spiders)
+        for work_path, state in items:
+            p = {"state": state}
+            spider = spiders.get(work_path)
+            if spider is not None:
+                p["done"] = spider.telemetry.done
+                p["total"] = spider.telemetry.total
+                p["eta"] = spider.telemetry.eta()
+            result[work_path] = p
+        return result
+
+
+if __name__ == "__main__":
+    # python -m scopus.scopus_jobs 清单文件 用户名 密码 [同时运行的任务数] [浏览器数]
+    args = sys.argv[1:]
+    runner = JobRunner(read_manifest(args[0]), args[1], args[2],
+                       max_jobs=int(args[3]) if len(args) > 3 else 4,
+                       browsers=int(args[4]) if len(args) > 4 else 2)
+    print(json.dumps(runner.run(), ensure_ascii=False, indent=2))
@@ -0,0 +1,153 @@
+"""
+查询拆分: 探测查询的结果条数, 超过阈值时按PUBYEAR、DOCTYPE、AFFILCOUNTRY递归拆成若干子查询,
+子查询交给JobRunner并行爬取, 最后按EID/DOI去重合并
+"""
+import datetime
+import json
+import os
+
+import pandas as pd
+
+import scopus.scopus_utils as su
+from scopus.scopus_jobs import JobRunner
+from scopus.scopus_spider import ScopusSpider
+from scopus.scopus_store import CheckpointStore
+
+DOCTYPES = ["ar", "re", "cp", "le", "ed", "no", "sh", "er", "ch", "bk", "dp"]
+AFFILCOUNTRIES = ["United States", "China", "United Kingdom", "Germany", "Japan", "France", "Canada", "Italy",
+                  "Australia", "Spain", "India", "Netherlands", "Switzerland", "South Korea", "Sweden"]
+
+
+def or_clause(field, values):
+    return "(" + " OR ".join(field + "(\"" + v + "\")" for v in values) + ")"
+
+
+class QueryPlanner(object):
+    """
+    probe(query)返回结果条数; threshold为单个子查询允许的最大条数
+    """
+    def __init__(self, probe, threshold=2000, min_year=1900, max_year=None, doctypes=None, countries=None):
+        self.probe = probe
+        self.threshold = threshold
+        self.min_year = min_year
+        self.max_year = max_year or datetime.date.today().year
+        self.doctypes = doctypes or DOCTYPES
+        self.countries = countries or AFFILCOUNTRIES
+
+    # 返回[(子查询, 条数)], 条数为0的子查询不返回
+    def plan(self, query):
+        query = query.strip()
+        facets = list()
+        if "PUBYEAR" not in query.upper():
+            facets.append("year")
+        if "DOCTYPE" not in query.upper():
+            facets.append("doctype")
+        if "AFFILCOUNTRY" not in query.upper():
+            facets.append("country")
+        result = list()
+        self.split(query, [], self.probe(query), facets, (self.min_year, self.max_year), result)
+        return result
+
+    # clauses为在原查询上追加的限定条件
+    def split(self, query, clauses, count, facets, years, result):
+        print("探测:" + self.build(query, clauses) + " -> " + str(count))
+        if count == 0:
+            return
+        if count <= self.threshold or len(facets) == 0:
+            result.append((self.build(query, clauses), count))
+            return
+        facet, rest = facets[0], facets[1:]
+        if facet == "year":
+            lo, hi = years
+            if lo == hi:
+                self.split(query, clauses, count, rest, years, result)
+                return
+            # 年份二分, 同一层只保留当前的年份区间
+            base = [c for c in clauses if not c.startswith("PUBYEAR") and not c.startswith("(PUBYEAR")]
+            mid = (lo + hi) // 2
+            for a, b in [(lo, mid), (mid + 1, hi)]:
+                sub = base + [self.year_clause(a, b)]
+                self.split(query, sub, self.probe(self.build(query, sub)), facets, (a, b), result)
+            return
+        if facet == "doctype":
+            values, field = self.doctypes, "DOCTYPE"
+        else:
+            values, field = self.countries, "AFFILCOUNTRY"
+        for v in values:
+            sub = clauses + [field + "(\"" + v + "\")"]
+            self.split(query, sub, self.probe(self.build(query, sub)), rest, years, result)
+        # 不属于上面任何一个取值的剩余部分, 保证拆分后不漏数据
+        sub = clauses + ["NOT " + or_clause(field, values)]
+        self.split(query, sub, self.probe(self.build(query, sub)), rest, years, result)
+
+    @staticmethod
+    def build(query, clauses):
+        if len(clauses) == 0:
+            return query
+        return "(" + query + ") AND " + " AND ".join(clauses)
+
+    @staticmethod
+    def year_clause(a, b):
+        if a == b:
+            return "PUBYEAR = " + str(a)
+        return "(PUBYEAR > " + str(a - 1) + " AND PUBYEAR < " + str(b + 1) + ")"
+
+
+# 用一个已登录的浏览器探测条数
+def browser_probe(work_path, username, password, **spider_kwargs):
+    spider = ScopusSpider(work_path, "", username, password, **spider_kwargs)
+    spider.start_driver()
+    spider.login()
+    return spider
+
+
+# 拆分查询 -> 并行爬取 -> 合并; 拆分结果保存在work_path/plan.json, 续爬时不再重新探测
+def run_partitioned(query, work_path, username, password, threshold=2000, max_jobs=4, browsers=2, **spider_kwargs):
+    if not os.path.exists(work_path):
+        os.makedirs(work_path)
+    plan_path = os.path.join(work_path, "plan.json")
+    if os.path.exists(plan_path):
+        with open(plan_path, encoding="utf-8") as f:
+            plan = json.load(f)
+    else:
+        spider = browser_probe(os.path.join(work_path, "probe"), username, password)
+        try:
+            plan = QueryPlanner(spider.count_results, threshold).plan(query)
+        finally:
+            spider.release_driver()
+        with open(plan_path, "w", encoding="utf-8") as f:
+            json.dump(plan, f, ensure_ascii=False, indent=2)
+    print("拆分为" + str(len(plan)) + "个子查询, 共" + str(sum(c for _, c in plan)) + "条(含重复)")
+    jobs = [{"query": q, "work_path": os.path.join(work_path, "part_" + str(i)), "mode": "crawl"}
+            for i, (q, _) in enumerate(plan)]
+    JobRunner(jobs, username, password, max_jobs=max_jobs, browsers=browsers, **spider_kwargs).run()
+    return merge_parts(work_path, [job["work_path"] for job in jobs])
+
+
+# 合并各子查询的爬取结果和scopus.csv, 按EID(没有时按DOI)去重
+def merge_parts(work_path, part_paths):
+    seen = set()
+    records = list()
+    exports = list()
+    for part in part_paths:
+        db = os.path.join(part, "tmp", "checkpoint.db")
+        if os.path.exists(db):
+            store = CheckpointStore(db)
+            for _, eid, record in store.iter_records():
+                key = eid or record.get("doi")
+                if key is None or key in seen:
+                    continue
+                seen.add(key)
+                if "doi" in record:
+                    records.append(record)
+            store.close()
+        csv = os.path.join(part, "tmp", "scopus.csv")
+        if os.path.exists(csv):
+            exports.append(pd.read_csv(csv, dtype=str))
+    su.reset_dict(records, os.path.join(work_path, "plumx.csv"))
+    if len(exports) > 0:
+        df = pd.concat(exports)
+        df = df.drop_duplicates(subset=["EID"] if "EID" in df.columns else None)
+        df.to_csv(os.path.join(work_path, "scopus.csv"), index=False)
+    print("合并后共" + str(len(records)) + "条")
+    return records
@@ -0,0 +1,105 @@
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+
+
+class WorkQueue(object):
+    """
+    持久化的指标任务队列(SQLite), 多个进程或共享同一文件系统的多台机器可以同时领取任务.
+    worker按批领取并获得有时限的租约, 完成后连同结果一起上报; 租约过期未完成的任务会被自动收回重新分配.
+    结果保存在队列文件里, 各worker的断点库只是本机缓存, 最后用iter_results()汇总
+    """
+    def __init__(self, path, lease_seconds=300, max_attempts=5):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        # 共享文件系统上不能用WAL(依赖共享内存), 这里保持默认的回滚日志模式
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS tasks ("
+                          "key TEXT PRIMARY KEY, idx INTEGER, eid TEXT, title TEXT, doi TEXT, "
+                          "state TEXT DEFAULT 'pending', owner TEXT, lease_until REAL, attempts INTEGER DEFAULT 0)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS tasks_state ON tasks(state, idx)")
+        # 旧版本的队列文件没有结果列
+        if "data" not in [row[1] for row in self.conn.execute("PRAGMA table_info(tasks)")]:
+            self.conn.execute("ALTER TABLE tasks ADD COLUMN data BLOB")
+
+    @staticmethod
+    def default_owner():
+        return socket.gethostname() + "-" + str(os.getpid())
+
+    # tasks为[(index, eid, 标题, doi)], 以eid(没有时用doi)去重
+    def add(self, tasks):
+        rows = list()
+        for index, eid, title, doi in tasks:
+            key = eid or doi
+            if key:
+                rows.append((key, index, eid, title, doi))
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany("INSERT OR IGNORE INTO tasks (key, idx, eid, title, doi) VALUES (?, ?, ?, ?, ?)", rows)
+            self.conn.execute("COMMIT")
+        return len(rows)
+
+    def claim(self, owner, n=50, lease_seconds=None):
+        now = time.time()
+        lease_until = now + (lease_seconds or self.lease_seconds)
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute("UPDATE tasks SET state = 'pending', owner = NULL "
+                                  "WHERE state = 'leased' AND lease_until < ?", (now,))
+                rows = self.conn.execute("SELECT key, idx, eid, title, doi FROM tasks WHERE state = 'pending' "
+                                         "ORDER BY idx LIMIT ?", (n,)).fetchall()
+                self.conn.executemany("UPDATE tasks SET state = 'leased', owner = ?, lease_until = ?, "
+                                      "attempts = attempts + 1 WHERE key = ?",
+                                      [(owner, lease_until, row[0]) for row in rows])
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return [(idx, eid, title, doi) for _, idx, eid, title, doi in rows]
+
+    # 延长owner持有的全部租约, 批次处理时间较长时调用
+    def renew(self, owner, lease_seconds=None):
+        with self.lock:
+            self.conn.execute("UPDATE tasks SET lease_until = ? WHERE state = 'leased' AND owner = ?",
+                              (time.time() + (lease_seconds or self.lease_seconds), owner))
+
+    def complete(self, key, owner, record=None):
+        data = pickle.dumps(record) if record is not None else None
+        with self.lock:
+            self.conn.execute("UPDATE tasks SET state = 'done', owner = NULL, data = ? WHERE key = ? AND owner = ?",
+                              (data, key, owner))
+
+    # 失败的任务放回队列, 超过max_attempts次后标记为failed
+    def fail(self, key, owner):
+        with self.lock:
+            self.conn.execute("UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                              "owner = NULL WHERE key = ? AND owner = ?", (self.max_attempts, key, owner))
+
+    # 按加入队列的顺序逐条返回已完成任务的(index, eid, record); idx只是各自列表文件里的行号, 会重复, 按rowid分批
+    def iter_results(self, batch=500):
+        last = 0
+        while True:
+            with self.lock:
+                rows = self.conn.execute("SELECT rowid, idx, eid, data FROM tasks WHERE state = 'done' "
+                                         "AND data IS NOT NULL AND rowid > ? ORDER BY rowid LIMIT ?",
+                                         (last, batch)).fetchall()
+            if len(rows) == 0:
+                return
+            for _, idx, eid, data in rows:
+                yield idx, eid, pickle.loads(data)
+            last = rows[-1][0]
+
+    def counts(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,319 @@
+"""
+离线录制/回放: 录制真实的结果页html和documentsfacade/plu.mx响应, 用本地假服务器按可配置的延迟、错误率和429比例回放,
+并在不需要scopus账号的情况下测量爬取流水线的吞吐量(条/秒)
+"""
+import hashlib
+import json
+import os
+import queue
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import scopus.scopus_utils as su
+
+
+# 响应以 path?query 为key, api.scopus.com和plu.mx的路径不会冲突, 回放时不需要区分host
+def response_key(url):
+    parts = urlparse(url)
+    return parts.path + ("?" + parts.query if parts.query else "")
+
+
+def response_file(fixture_dir, key):
+    return os.path.join(fixture_dir, "responses", hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+
+class Recorder(object):
+    """
+    挂在spider.recorder上, 爬取时把结果页和接口响应保存成fixture
+    """
+    def __init__(self, fixture_dir):
+        self.fixture_dir = fixture_dir
+        self.lock = threading.Lock()
+        for d in ["pages", "responses"]:
+            os.makedirs(os.path.join(fixture_dir, d), exist_ok=True)
+
+    def record_page(self, page, html):
+        with open(os.path.join(self.fixture_dir, "pages", str(page) + ".html"), "w", encoding="utf-8") as f:
+            f.write(html)
+
+    def record_response(self, url, status, body):
+        key = response_key(url)
+        with open(response_file(self.fixture_dir, key), "w", encoding="utf-8") as f:
+            json.dump({"key": key, "status": status, "body": body.decode("utf-8")}, f, ensure_ascii=False)
+
+    def record_meta(self, total):
+        with self.lock:
+            with open(os.path.join(self.fixture_dir, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump({"total": total}, f)
+
+
+# 没有录制数据时生成结构相同的合成fixture
+def generate_fixtures(fixture_dir, total=500, perpage=50):
+    recorder = Recorder(fixture_dir)
+    pages = (total + perpage - 1) // perpage
+    for page in range(pages):
+        rows = list()
+        for i in range(min(perpage, total - page * perpage)):
+            n = page * perpage + i
+            eid = "2-s2.0-" + str(85000000000 + n)
+            rows.append('<tr id="resultDataRow' + str(i) + '"><td data-type="docTitle">'
+                        '<a href="https://www.scopus.com/record/display.uri?eid=' + eid + '&origin=resultslist">'
+                        'Paper ' + str(n) + '</a></td></tr>')
+            recorder.record_response("https://api.scopus.com/documentsfacade/documents/" + eid + "/metrics", 200,
+                                     json.dumps({"plumXMetrics": {"link": "https://plu.mx/a/" + str(n)}}).encode("utf-8"))
+            recorder.record_response("https://plu.mx/api/v1/artifact/id/" + str(n), 200, json.dumps({
+                "identifier": {"doi": [{"value": "10.9999/fake." + str(n)}]},
+                "sort_count": {"capture": {"total": n % 97, "count_types": [
+                    {"name": "READER_COUNT", "total": n % 97, "sources": [{"name": "Mendeley", "total": n % 97}]}]}},
+            }).encode("utf-8"))
+        recorder.record_page(page, "<html><body><table>" + "".join(rows) + "</table></body></html>")
+    recorder.record_meta(total)
+
+
+class FakeScopusServer(object):
+    """
+    本地替身服务器, 回放fixture中的documentsfacade/plu.mx响应;
+    latency为平均延迟(秒), error_rate为返回500的比例, throttle_rate为返回429(带Retry-After)的比例
+    """
+    def __init__(self, fixture_dir, latency=0.05, error_rate=0.0, throttle_rate=0.0, retry_after=1, port=0):
+        self.fixture_dir = fixture_dir
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return "http://127.0.0.1:" + str(self.httpd.server_address[1])
+
+    @property
+    def host(self):
+        return "127.0.0.1:" + str(self.httpd.server_address[1])
+
+    def handle(self, request):
+        if self.latency > 0:
+            time.sleep(self.latency * random.uniform(0.5, 1.5))
+        r = random.random()
+        if r < self.throttle_rate:
+            request.send_response(429)
+            request.send_header("Retry-After", str(self.retry_after))
+            request.end_headers()
+            return
+        if r < self.throttle_rate + self.error_rate:
+            request.send_response(500)
+            request.end_headers()
+            return
+        p = response_file(self.fixture_dir, request.path)
+        if not os.path.exists(p):
+            request.send_response(404)
+            request.end_headers()
+            return
+        with open(p, encoding="utf-8") as f:
+            fixture = json.load(f)
+        body = fixture["body"].encode("utf-8")
+        request.send_response(fixture["status"])
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class ReplayDriver(object):
+    """
+    代替webdriver.Chrome回放录制的结果页, 只实现流水线用到的接口; page_delay为每次翻页/打开页面模拟的耗时(秒)
+    """
+    def __init__(self, fixture_dir, page_delay=0.0, perpage=50):
+        self.fixture_dir = fixture_dir
+        self.page_delay = page_delay
+        self.perpage = perpage
+        self.page = 0
+        self.current_url = "https://www.scopus.com/results/results.uri?offset=1"
+
+    @property
+    def page_source(self):
+        with open(os.path.join(self.fixture_dir, "pages", str(self.page) + ".html"), encoding="utf-8") as f:
+            return f.read()
+
+    def execute_script(self, script, *args):
+        from scopus.scopus_spider import PAGE_KEY_JS, SIGNED_IN_JS, EXTRACT_ROWS_JS, RESULTS_STATE_JS
+        if "NextPageButton" in script:
+            time.sleep(self.page_delay)
+            self.page += 1
+            self.current_url = "https://www.scopus.com/results/results.uri?offset=" + str(self.page * self.perpage + 1)
+            return None
+        if script == SIGNED_IN_JS:
+            return True
+        if script == RESULTS_STATE_JS:
+            return "results"
+        if script == PAGE_KEY_JS:
+            rows = su.extract_rows(self.page_source)
+            return rows[0][1] if len(rows) > 0 else None
+        if script == EXTRACT_ROWS_JS:
+            return json.dumps([[i, href, title] for i, href, _, title in su.extract_rows(self.page_source)])
+        # 其他脚本(如点击复选框)在回放中没有效果
+        return None
+
+    # 结果页按offset参数定位到对应的页, 其他页面(检索表单等)不改变当前页
+    def get(self, url):
+        time.sleep(self.page_delay)
+        self.current_url = url
+        offset = parse_qs(urlparse(url).query).get("offset")
+        if offset:
+            self.page = (int(offset[0]) - 1) // self.perpage
+
+    # 检索表单: 点检索按钮回到结果第0页
+    def find_element_by_id(self, id):
+        return ReplayElement(self, id)
+
+    def find_elements_by_id(self, id):
+        return []
+
+    # 结果总条数取自meta.json
+    def find_element_by_class_name(self, name):
+        element = ReplayElement(self, name)
+        with open(os.path.join(self.fixture_dir, "meta.json"), encoding="utf-8") as f:
+            element.text = "{:,}".format(json.load(f)["total"])
+        return element
+
+    def execute_cdp_cmd(self, cmd, params):
+        return {}
+
+    def get_cookies(self):
+        return []
+
+    def close(self):
+        pass
+
+    def quit(self):
+        pass
+
+
+class ReplayElement(object):
+    def __init__(self, driver, id):
+        self.driver = driver
+        self.id = id
+
+    def clear(self):
+        pass
+
+    def send_keys(self, value):
+        pass
+
+    def click(self):
+        if self.id == "advSearch":
+            self.driver.get("https://www.scopus.com/results/results.uri?offset=1")
+
+
+class ReplayPool(object):
+    """
+    代替BrowserPool, 最多同时借出size个ReplayDriver, 用于测量多浏览器分段翻页
+    """
+    def __init__(self, fixture_dir, page_delay=0.0, size=8):
+        self.fixture_dir = fixture_dir
+        self.page_delay = page_delay
+        self.slots = threading.Semaphore(size)
+        self.size = size
+        self.leased = 0
+        self.lock = threading.Lock()
+
+    def available(self):
+        with self.lock:
+            return self.size - self.leased
+
+    def acquire(self, timeout=None):
+        from scopus.scopus_browser import Lease
+        if not self.slots.acquire(timeout=timeout):
+            raise queue.Empty()
+        with self.lock:
+            self.leased += 1
+        slot = type("ReplaySlot", (object,), {})()
+        slot.driver = ReplayDriver(self.fixture_dir, self.page_delay)
+        slot.pages = 0
+        return Lease(slot)
+
+    def release(self, lease, broken=False):
+        with self.lock:
+            self.leased -= 1
+        self.slots.release()
+
+
+# 离线跑一遍翻页+指标流水线, 返回条/秒等结果; page_workers为同时翻页的浏览器数
+def run_benchmark(fixture_dir, latency=0.05, error_rate=0.0, throttle_rate=0.0, max_workers=10, rate=1000.0,
+                  page_workers=1, page_delay=0.0, extract_mode="script"):
+    from scopus.scopus_spider import ScopusSpider
+    with open(os.path.join(fixture_dir, "meta.json"), encoding="utf-8") as f:
+        total = json.load(f)["total"]
+    server = FakeScopusServer(fixture_dir, latency, error_rate, throttle_rate).start()
+    work_path = tempfile.mkdtemp()
+    try:
+        spider = ScopusSpider(work_path, "benchmark", "", "", max_workers=max_workers, rates={server.host: rate},
+                              extract_mode=extract_mode, cache_dir=False, persist_session=False)
+        spider.metrics_url = server.base_url + "/documentsfacade/documents/{}/metrics"
+        spider.plumx_id_url = server.base_url + "/api/v1/artifact/id/{}"
+        spider.plumx_doi_url = server.base_url + "/api/v1/artifact/doi/{}"
+        spider.driver = ReplayDriver(fixture_dir, page_delay)
+        spider.browser_pool = ReplayPool(fixture_dir, page_delay)
+        total_pages = (total + spider.perpage - 1) // spider.perpage
+        spider.telemetry.set_total(total)
+        t = time.perf_counter()
+        spider.run_pipeline(0, total_pages, total, page_workers=page_workers)
+        elapsed = time.perf_counter() - t
+        done = len(spider.store)
+        spider.store.close()
+        spider.http.close()
+        return {
+            "total": total,
+            "done": done,
+            "elapsed": elapsed,
+            "records_per_second": done / elapsed if elapsed > 0 else 0.0,
+            "http": spider.http_stats(),
+            "stages": spider.telemetry.snapshot()["stages"],
+        }
+    finally:
+        server.stop()
+        shutil.rmtree(work_path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    # python -m scopus.scopus_replay [fixture目录] [延迟] [错误率] [429比例] [并发数] [翻页浏览器数] [翻页耗时] [script|html]
+    args = sys.argv[1:]
+    fixture_dir = args[0] if len(args) > 0 else os.path.join(tempfile.gettempdir(), "scopus_fixtures")
+    if not os.path.exists(os.path.join(fixture_dir, "meta.json")):
+        print("生成合成fixture:" + fixture_dir)
+        generate_fixtures(fixture_dir)
+    result = run_benchmark(fixture_dir,
+                           latency=float(args[1]) if len(args) > 1 else 0.05,
+                           error_rate=float(args[2]) if len(args) > 2 else 0.0,
+                           throttle_rate=float(args[3]) if len(args) > 3 else 0.0,
+                           max_workers=int(args[4]) if len(args) > 4 else 10,
+                           page_workers=int(args[5]) if len(args) > 5 else 1,
+                           page_delay=float(args[6]) if len(args) > 6 else 0.0,
+                           extract_mode=args[7] if len(args) > 7 else "script")
+    print(json.dumps(result, ensure_ascii=False, indent=2))
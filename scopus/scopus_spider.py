@@ -1,20 +1,94 @@
+import copy
 import json
 import os
-import pickle
 import time
 import math
 import traceback
+import queue
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode, quote
 
-import requests
-from selenium.common.exceptions import TimeoutException
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from selenium.webdriver.chrome.options import Options
 from selenium import webdriver
-from bs4 import BeautifulSoup as BS
+from selenium.webdriver.support.ui import WebDriverWait
 import scopus.scopus_utils as su
+from scopus.scopus_http import SessionPool, RetryPolicy, RateLimiter
+from scopus.scopus_store import CheckpointStore
+from scopus.scopus_queue import WorkQueue
+from scopus.scopus_cache import ResponseCache
+from scopus.scopus_telemetry import Telemetry
+from scopus.scopus_download import DownloadWatcher
+
+HEADLESS_ARGS = [
+    "--headless",
+    "--window-size=1920,1080",
+    "--disable-extensions",
+    "--disable-dev-shm-usage",
+    "--disable-background-networking",
+    "--disable-notifications",
+    "--mute-audio",
+    "--blink-settings=imagesEnabled=false",
+    "--js-flags=--max-old-space-size=512",
+    "--renderer-process-limit=2",
+]
+HEADLESS_PREFS = {
+    "profile.managed_default_content_settings.images": 2,
+    "profile.managed_default_content_settings.media_stream": 2,
+    "profile.default_content_setting_values.notifications": 2,
+}
+BLOCKED_URL_PATTERNS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.svg", "*.ico", "*.webp",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    "*.mp4", "*.webm", "*.mp3",
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*",
+    "*adobedtm.com*", "*omtrdc.net*", "*demdex.net*", "*nr-data.net*", "*newrelic.com*",
+    "*hotjar.com*", "*pendo.io*", "*crazyegg.com*",
+]
+
+# 在结果页内执行, 返回JSON字符串[[行号, 链接, 标题], ...]
+EXTRACT_ROWS_JS = """
+var rows = [];
+var trs = document.querySelectorAll("tr[id^='resultDataRow']");
+for (var k = 0; k < trs.length; k++) {
+    var m = /^resultDataRow(\\d+)$/.exec(trs[k].id);
+    if (!m) continue;
+    var a = trs[k].querySelector("td[data-type='docTitle'] a");
+    if (!a) continue;
+    rows.push([parseInt(m[1], 10), a.getAttribute("href") || "", a.textContent.trim()]);
+}
+return JSON.stringify(rows);
+"""
+# scopus页面加载完成后不显示登录入口(signin_link_move)即为已登录; 是否在scopus.com上由logged_in检查
+SIGNED_IN_JS = """
+if (document.readyState === "loading") return false;
+var signin = document.getElementById("signin_link_move");
+return !(signin && signin.offsetParent !== null);
+"""
+# 检索后的页面状态: 有结果数返回"results", 明确提示没有结果返回"empty", 还在加载返回null
+RESULTS_STATE_JS = """
+if (document.readyState === "loading") return null;
+if (document.querySelector(".resultsCount")) return "results";
+var text = document.body ? document.body.innerText : "";
+if (document.querySelector("#noResultsMessage, .noResults, [data-testid='no-results']")
+    || /No documents were found|No results found/i.test(text)) return "empty";
+return null;
+"""
+# 结果页第一行的链接, 页面还在加载或没有结果行时返回null
+PAGE_KEY_JS = """
+if (document.readyState === "loading") return null;
+var a = document.querySelector("tr[id^='resultDataRow'] td[data-type='docTitle'] a");
+return a ? a.getAttribute("href") : null;
+"""
 
 
 class ScopusSpider(object):
-    def __init__(self, work_path, search, username, password):
+    def __init__(self, work_path, search, username, password, max_workers=10, pool_size=None, keep_alive=True,
+                 max_attempts=6, rates=None, profile="default", extract_mode="script", cache_dir=None, cache_ttls=None,
+                 resolver="eid", persist_session=True, http=None, browser_pool=None, page_timeout=30,
+                 page_workers=1):
         self.option = Options()
         self.work_path = work_path
         self.search = search
@@ -28,174 +102,872 @@ class ScopusSpider(object):
         self.pickle_save_path = os.path.join(self.download_path, "pickles")
         if not os.path.exists(self.download_path):
             os.mkdir(self.download_path)
+        # 所有论文的爬取结果都存在这一个文件里, 旧版本的pickles目录会在启动时导入
+        self.store = CheckpointStore(os.path.join(self.download_path, "checkpoint.db"))
+        self.store.import_pickles(self.pickle_save_path)
+        # profile: "default"为有界面的完整浏览器, "headless"为无界面且不加载图片/字体/媒体的精简浏览器
+        self.profile = profile
         prefs = {
             "download.default_directory": self.download_path,
             "download.prompt_for_download": False,
         }
         self.option.add_argument("start-maximized")
         self.option.add_argument("disable-gpu")
+        if self.profile == "headless":
+            for arg in HEADLESS_ARGS:
+                self.option.add_argument(arg)
+            prefs.update(HEADLESS_PREFS)
         self.option.add_experimental_option("prefs", prefs)
+        # 登录状态持久化: 登录后的cookies存到session.json, chrome用户目录固定在tmp/chrome_profile, 重启时直接复用
+        self.persist_session = persist_session
+        self.session_path = os.path.join(self.download_path, "session.json")
+        if self.persist_session:
+            self.option.add_argument("--user-data-dir=" + os.path.join(self.download_path, "chrome_profile"))
         self.chrome_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "chromedriver.exe")
 
 
         self.url = "https://www.scopus.com/home.uri"
+        self.search_form_url = "https://www.scopus.com/search/form.uri?display=advanced"
+        self.metrics_url = "https://api.scopus.com/documentsfacade/documents/{}/metrics"
+        self.plumx_id_url = "https://plu.mx/api/v1/artifact/id/{}"
+        self.plumx_doi_url = "https://plu.mx/api/v1/artifact/doi/{}"
+        # 指标解析方式: "eid"为EID -> documentsfacade -> PlumX id两跳, "doi"为有DOI时直接按DOI查plu.mx
+        self.resolver = resolver
         self.perpage = 50
+        # 结果页取数方式: "script"在浏览器内抽取行数据, "html"传回整个page_source再解析
+        self.extract_mode = extract_mode
+        # 翻页后等待新结果页出现的最长秒数
+        self.page_timeout = page_timeout
+        # 同时在途的指标请求数
+        self.max_workers = max_workers
+        # 各阶段耗时、各host延迟和错误、吞吐量和预计剩余时间, 运行中写到tmp/telemetry.json
+        self.telemetry = Telemetry()
+        self.telemetry_path = os.path.join(self.download_path, "telemetry.json")
+        # 按host复用的keep-alive连接池, 连接数默认与并发数一致; 请求失败时指数退避重试, 同一host连续失败后熔断;
+        # rates为各host每秒请求数, 如{"api.scopus.com": 5, "plu.mx": 5}, 收到429时自动降速.
+        # 批量任务时由外部传入共享的http, 此时不由本spider关闭
+        self.own_http = http is None
+        self.http = http
+        if self.own_http:
+            self.http = SessionPool(pool_size=pool_size or max_workers, keep_alive=keep_alive, telemetry=self.telemetry,
+                                    retry_policy=RetryPolicy(max_attempts=max_attempts),
+                                    limiter=RateLimiter(rates))
+        # scopus_browser.BrowserPool, 设置后从池里借已登录的浏览器, 用完归还而不关闭
+        self.browser_pool = browser_pool
+        self.own_pool = False
+        self.lease = None
+        # 同时翻页的浏览器数, 大于1时把剩下的页分成连续的几段, 每个浏览器跳到自己那段的起始页翻页
+        self.page_workers = page_workers
+        self.range_workers = list()
+        # 翻页分身等待空闲浏览器的最长秒数, 借不到时那一段由当前浏览器接着翻
+        self.lease_timeout = 30
+        self.driver = None
+        # 响应缓存, 多个查询可以共用同一个cache_dir; cache_dir=False时不使用缓存
+        self.cache = None
+        if cache_dir is not False:
+            self.cache = ResponseCache(cache_dir or os.path.join(self.download_path, "http_cache"), cache_ttls)
+        # 设置为scopus_replay.Recorder时, 爬取过程中的结果页和接口响应会被保存为离线回放用的fixture
+        self.recorder = None
         self.go = True
 
+    def telemetry_snapshot(self):
+        result = self.telemetry.snapshot()
+        result["http"] = self.http_stats()
+        return result
+
+    def speed_text(self):
+        rate = self.telemetry.throughput()
+        eta = self.telemetry.eta()
+        text = " 速度:" + str(round(rate, 2)) + "条/秒"
+        if eta is not None:
+            text += ", 预计剩余:" + str(math.ceil(eta / 60)) + "分钟"
+        return text
+
+    def http_stats(self):
+        result = self.http.stats()
+        if self.cache is not None:
+            result["cache"] = self.cache.stats()
+        return result
+
     def resolve_data_clicked(self):
         self.read_pick(self.pickle_save_path)
 
-    def run(self):
+    # 从浏览器池借时最多等timeout秒, 超时抛出queue.Empty
+    def start_driver(self, timeout=None):
+        if self.browser_pool is not None:
+            self.lease = self.browser_pool.acquire(timeout)
+            self.driver = self.lease.driver
+            try:
+                # 池里的浏览器下载目录是它自己的, 改成本spider的tmp
+                self.driver.execute_cdp_cmd("Page.setDownloadBehavior",
+                                            {"behavior": "allow", "downloadPath": self.download_path})
+            except Exception:
+                traceback.print_exc()
+            return
         self.driver = webdriver.Chrome(executable_path=self.chrome_path, chrome_options=self.option)
         self.driver.set_page_load_timeout(120)
-        while self.go:
+        if self.profile == "headless":
             try:
-                self.driver.get(self.url)
-                break
-            except TimeoutException:
-                time.sleep(1)
-                continue
-        self.driver.find_element_by_id("signin_link_move").click()
+                # 通过DevTools拦截字体、媒体和统计脚本请求; 无界面模式下需要显式允许下载
+                self.driver.execute_cdp_cmd("Network.enable", {})
+                self.driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URL_PATTERNS})
+                self.driver.execute_cdp_cmd("Page.setDownloadBehavior",
+                                            {"behavior": "allow", "downloadPath": self.download_path})
+            except Exception:
+                traceback.print_exc()
+
+    # broken为True时池会重启这个浏览器而不是直接借给下一个任务
+    def release_driver(self, broken=False):
+        if self.lease is not None:
+            lease, self.lease, self.driver = self.lease, None, None
+            self.browser_pool.release(lease, broken)
+            return
+        if self.driver is None:
+            return
+        driver, self.driver = self.driver, None
+        try:
+            driver.quit()
+        except Exception:
+            traceback.print_exc()
+
+    def close_http(self):
+        if self.own_http:
+            self.http.close()
+
+    # 先尝试复用保存的登录状态, 失效时才重新输入账号密码
+    def login(self):
+        # 从池里借到的浏览器已经登录过, 当前页面仍是登录状态时直接使用
+        if self.lease is not None and self.logged_in():
+            return
+        self.open_home()
+        if self.persist_session and self.restore_session():
+            print("复用已保存的登录状态")
+            return
+        # 首页没有登录链接时可能已经跳到了登录表单, 直接填写
+        signin = self.driver.find_elements_by_id("signin_link_move")
+        if len(signin) > 0:
+            signin[0].click()
 
         self.driver.find_element_by_id("bdd-email").send_keys(self.username)
         self.driver.find_element_by_id("bdd-elsPrimaryBtn").click()
         self.driver.find_element_by_id("bdd-password").send_keys(self.password)
         self.driver.find_element_by_id("bdd-elsPrimaryBtn").click()
-        # self.driver.get("https://www.scopus.com/search/form.uri?display=advanced")
-        self.driver.find_element_by_id("searchfield").send_keys(self.search)
-        self.driver.find_element_by_id("advSearch").click()
+        if self.persist_session:
+            self.save_session()
 
-        # 全选并下载
-        if not os.path.exists(os.path.join(self.download_path, "scopus.csv")):
-            checkbox = self.driver.find_element_by_id("mainResults-selectAllTop")
-            self.driver.execute_script("arguments[0].click()", checkbox)
-            self.driver.find_element_by_id("directExport").click()
+    def open_home(self, max_tries=5):
+        for _ in range(max_tries):
+            if not self.go:
+                return
+            try:
+                self.driver.get(self.url)
+                return
+            except TimeoutException:
+                time.sleep(1)
+        raise TimeoutException("打开首页超时:" + self.url)
+
+    # 当前页面在scopus.com上、加载完成并且没有显示登录链接; 登录过程中停在id.elsevier.com或跳转中间页时都不算
+    def logged_in(self):
+        try:
+            if not urlparse(self.driver.current_url).netloc.lower().endswith("scopus.com"):
+                return False
+            return self.driver.execute_script(SIGNED_IN_JS) is True
+        except WebDriverException:
+            return False
 
-        # 计算并翻页
+    def restore_session(self):
+        # chrome用户目录里的登录状态可能仍然有效
+        if self.logged_in():
+            return True
+        if not os.path.exists(self.session_path):
+            return False
+        with open(self.session_path, encoding="utf-8") as f:
+            cookies = json.load(f)
+        for cookie in cookies:
+            try:
+                self.driver.add_cookie(cookie)
+            except Exception:
+                continue
+        self.open_home()
+        return self.logged_in()
+
+    # 等到跳回scopus并确认已登录后才保存, 此时get_cookies()拿到的是scopus.com的cookies
+    def save_session(self, timeout=30):
+        try:
+            WebDriverWait(self.driver, timeout).until(lambda d: self.logged_in())
+        except TimeoutException:
+            print("登录后未检测到登录状态, 不保存")
+            return
+        with open(self.session_path, "w", encoding="utf-8") as f:
+            json.dump(self.driver.get_cookies(), f)
+
+    def run(self):
+        if self.page_workers > 1 and self.browser_pool is None:
+            from scopus.scopus_browser import BrowserPool
+            self.browser_pool = BrowserPool(os.path.join(self.download_path, "browsers"), self.username,
+                                            self.password, size=self.page_workers, profile=self.profile)
+            self.own_pool = True
+        # 中途出错(等页面超时、找不到结果数等)时也要关闭浏览器和连接池、写入未落盘的记录;
+        # 出错时浏览器可能停在任意页面, 借来的浏览器按损坏归还
+        broken = True
+        try:
+            with self.telemetry.stage("login"):
+                self.start_driver()
+                self.login()
+            with self.telemetry.stage("search"):
+                # 借来的浏览器停在上一次的页面上, 要先打开检索表单
+                self.submit_search(self.search, new_form=self.lease is not None)
+                self.wait_page_change()
+
+            # 全选并下载, 下载完成后边翻页边从csv读取论文送进指标流水线
+            if not os.path.exists(os.path.join(self.download_path, "scopus.csv")):
+                checkbox = self.driver.find_element_by_id("mainResults-selectAllTop")
+                self.driver.execute_script("arguments[0].click()", checkbox)
+                self.driver.find_element_by_id("directExport").click()
+            export = DownloadWatcher(self.download_path)
+
+            # 计算并翻页
+            total = self.result_count()
+            print("总条数：" + str(total))
+            total_pages = math.ceil(total / self.perpage)
+            print("总页数:" + str(total_pages))
+            self.telemetry.set_total(total, len(self.store))
+            if self.recorder is not None:
+                self.recorder.record_meta(total)
+
+            # 从游标记录的最后完成页之后继续, 直接跳页而不是从第0页逐页点过去
+            cursor = self.store.load_cursor(self.search)
+            done_page = -1
+            if cursor is not None and cursor["total"] == total:
+                done_page = cursor["page"]
+            cur_page = done_page + 1
+            if 0 < cur_page < total_pages:
+                print("从第" + str(cur_page + 1) + "页继续")
+                self.jump_to_page(cur_page)
+
+            self.run_pipeline(cur_page, total_pages, total, done_page, export, page_workers=self.page_workers)
+            broken = False
+        finally:
+            self.release_driver(broken)
+            if self.own_pool:
+                self.browser_pool.close()
+                self.browser_pool = None
+                self.own_pool = False
+            self.close_http()
+            self.store.flush()
+        self.telemetry.dump(self.telemetry_path)
+        # 只有没被停止且游标走到最后一页(所有页的所有条目都已完成)时才标记完成, 否则下次运行会继续
+        finished = self.go and self.pipeline["done_page"] == total_pages - 1
+        if finished and not os.path.exists(os.path.join(self.download_path, "finish")):
+            os.mkdir(os.path.join(self.download_path, "finish"))
+        self.read_pick(self.pickle_save_path)
+        self.merge_export(export)
+
+    def submit_search(self, query, new_form=False):
+        if new_form:
+            self.driver.get(self.search_form_url)
+        searchfield = self.driver.find_element_by_id("searchfield")
+        searchfield.clear()
+        searchfield.send_keys(query)
+        self.driver.find_element_by_id("advSearch").click()
+
+    def result_count(self):
         total_str = self.driver.find_element_by_class_name("resultsCount").text
-        print("总条数：" + total_str)
-        total_str = total_str.replace(",", "")
-        total = int(total_str)
-        total_pages = math.ceil(total / self.perpage)
-        print("总页数:" + str(total_pages))
-
-        cur_page = 0
-
-        while cur_page < total_pages:
-            c = self.driver.get_cookies()
-            cookies = dict()
-            for cookie in c:
-                cookies[cookie["name"]] = cookie["value"]
-
-            if not os.path.exists(self.pickle_save_path):
-                os.mkdir(self.pickle_save_path)
-            if cur_page != total_pages - 1:
-                page_detail = self.resolve_html(self.driver.page_source, cur_page, total, self.perpage, cookies, self.pickle_save_path)
-                self.driver.execute_script("setSelectedLink('NextPageButton');")  # 翻页
-            else:
-                page_detail = self.resolve_html(self.driver.page_source, cur_page, total, total % self.perpage, cookies,
-                                           self.pickle_save_path)
-            cur_page += 1
-        self.driver.close()
-        os.mkdir(os.path.join(self.download_path, "finish"))
-        self.read_pick(pickle_save_path)
+        return int(total_str.replace(",", ""))
 
-    def stop(self):
-        self.go = False
-        self.driver.quit()
+    # 查询条数, 供查询拆分时探测结果规模; 等到结果页出现, 只有页面明确提示没有结果时才返回0,
+    # 超过page_timeout秒仍在加载时抛出TimeoutException, 避免把这个子查询当成空的丢掉
+    def count_results(self, query):
+        self.submit_search(query, new_form=True)
+        state = WebDriverWait(self.driver, self.page_timeout, poll_frequency=0.1).until(
+            lambda d: self.results_state(), "等待检索结果超时:" + query)
+        if state == "empty":
+            return 0
+        return self.result_count()
 
-    def resolve_html(self, html, page, total, rest=50, cookies="", save_path=""):
-        soup = BS(html, "html.parser")
-        PlumXdetails = list()
-        for i in range(0, rest):
-            html_id = "resultDataRow" + str(i)
-            print("html_id=" + html_id)
-            title_bs = soup.find("tr", id=html_id)
-            try:
-                row_data_bs = title_bs.find("td", attrs={"data-type": "docTitle"})
-            except:
-                traceback.print_exc()
+    def results_state(self):
+        try:
+            return self.driver.execute_script(RESULTS_STATE_JS)
+        except WebDriverException:
+            return None
+
+    # 只爬指标: EID/DOI直接来自导出的scopus.csv(或任意csv/每行一个EID的列表文件), 不用selenium翻页和解析结果页,
+    # 浏览器只用来登录拿cookies
+    def run_from_csv(self, csv_path=None, chunk_size=500):
+        export = os.path.join(self.download_path, "scopus.csv")
+        if csv_path is None:
+            csv_path = export
+        # 只有本spider导出的scopus.csv的行号和结果序号一致, 其它列表文件按EID/DOI跳过和保存
+        keyed = os.path.abspath(csv_path) != os.path.abspath(export)
+        rows = su.read_id_list(csv_path)
+        print("从" + csv_path + "读到" + str(len(rows)) + "条")
+        self.login_cookies()
+
+        tasks = list()
+        for index, eid, paper_title, doi in rows:
+            if eid == "" and (self.resolver != "doi" or doi == ""):
+                print("缺少EID, 跳过第" + str(index) + "条")
                 continue
-            paper_info_url = row_data_bs.a["href"]
-            paper_title = str(row_data_bs.a.string)
-            if os.path.exists(os.path.join(save_path, str(self.perpage * (page) + i) + ".pickle")):
+            if self.store.has_eid(eid) or self.store.has_key(eid or doi):
                 continue
-            # print(paper_title + ":" + paper_info_url)
-            url_params = paper_info_url.split("?")[1].split("&")
-            eid = ""
-            for p in url_params:
-                if "eid" in p:
-                    eid = p.split("=")[1]
-            pre_url = "https://api.scopus.com/documentsfacade/documents/" + eid + "/metrics"
-            try:
-                r_json = self.get_html_by_requests(pre_url, cookies)
-                pre_json = json.loads(r_json)
-            except:
-                print(r_json)
-                traceback.print_exc()
+            if not keyed and self.store.is_done(index):
                 continue
+            tasks.append((index, eid, paper_title, doi))
+        total = len(rows)
+        self.telemetry.set_total(total, total - len(tasks))
+        for i in range(0, len(tasks), chunk_size):
+            if not self.go:
+                break
+            self.fetch_metrics(tasks[i:i + chunk_size], i // chunk_size, total, keyed=keyed)
+            self.telemetry.dump(self.telemetry_path)
+        self.close_http()
+        self.store.flush()
+
+    # 只登录拿cookies, 之后关闭浏览器
+    def login_cookies(self):
+        self.start_driver()
+        self.login()
+        self.http.update_cookies(self.driver.get_cookies())
+        self.release_driver()
+
+    # 把csv/列表文件中的论文加入共享任务队列
+    def enqueue(self, queue_path, csv_path=None):
+        if csv_path is None:
+            csv_path = os.path.join(self.download_path, "scopus.csv")
+        wq = WorkQueue(queue_path)
+        n = wq.add(su.read_id_list(csv_path))
+        print("加入队列" + str(n) + "条, 队列状态:" + str(wq.counts()))
+        wq.close()
+
+    # 从共享任务队列按批领取任务, 多个进程/机器可以同时运行; 结果随完成状态一起写回队列文件,
+    # 本spider的断点库(WAL, 应放在本机磁盘上)只用来跳过本机已经爬过的论文. 队列里的序号只是各列表文件的行号,
+    # 本地按EID/DOI保存, 不会覆盖结果列表中的记录
+    def run_worker(self, queue_path, owner=None, batch_size=50, lease_seconds=300):
+        wq = WorkQueue(queue_path, lease_seconds=lease_seconds)
+        owner = owner or WorkQueue.default_owner()
+        self.login_cookies()
+        while self.go:
+            tasks = wq.claim(owner, batch_size)
+            if len(tasks) == 0:
+                break
+            renewed = time.time()
+            todo = list()
+            for task in tasks:
+                index, eid, paper_title, doi = task
+                record = None
+                if self.store.has_key(eid or doi):
+                    record = self.store.get_keyed(eid or doi)
+                elif eid and self.store.has_eid(eid):
+                    record = self.store.get_by_eid(eid)
+                if record is not None:
+                    wq.complete(eid or doi, owner, record)
+                else:
+                    todo.append(task)
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = {executor.submit(self.resolve_metrics, task, "", True): task for task in todo}
+                for future in as_completed(futures):
+                    # 批次处理超过半个租约时续租, 避免被其他worker收回
+                    if time.time() - renewed > lease_seconds / 2:
+                        wq.renew(owner)
+                        renewed = time.time()
+                    index, eid, paper_title, doi = futures[future]
+                    record = future.result()[1]
+                    if record is None:
+                        wq.fail(eid or doi, owner)
+                    else:
+                        wq.complete(eid or doi, owner, record)
+            self.store.flush()
+            print(owner + " 队列状态:" + str(wq.counts()))
+        self.close_http()
+        wq.close()
+
+    # 汇总共享队列里所有worker的结果, 写到本spider的plumx.csv
+    def collect_queue(self, queue_path):
+        wq = WorkQueue(queue_path)
+        objs = [record for _, _, record in wq.iter_results() if "doi" in record]
+        wq.close()
+        su.reset_dict(objs, os.path.join(self.download_path, "plumx.csv"))
+        return objs
+
+    # 流水线: 当前线程(持有driver)翻页并把(index, eid, 标题, doi)放进有界队列, max_workers个线程从队列取出请求指标并写断点库;
+    # 队列满时翻页阻塞, 浏览器不会跑得太靠前.
+    # export为DownloadWatcher时另开一个线程等导出的csv下载完成, 分块读取后也放进同一个队列; 两边按序号和EID去重,
+    # csv的行号与结果页的序号一致(导出顺序与结果列表相同). csv把全部结果都送进队列后不再翻页.
+    # page_workers大于1且有浏览器池时, [cur_page, total_pages)分成连续的几段, 当前driver翻第一段, 其余每段从池里借一个浏览器
+    def run_pipeline(self, cur_page, total_pages, total, done_page=-1, export=None, queue_size=None, page_workers=1):
+        q = queue.Queue(maxsize=queue_size or self.perpage * 2)
+        self.pipeline_lock = threading.Lock()
+        self.pipeline = {"total": total, "done_page": done_page, "pending": dict(), "rest": dict(),
+                         "claimed": dict(), "claimed_eids": set(), "listed": False, "exported": False}
+        workers = [threading.Thread(target=self.consume, args=(q,), daemon=True) for _ in range(self.max_workers)]
+        for w in workers:
+            w.start()
+        feeder = None
+        if export is not None:
+            feeder = threading.Thread(target=self.feed_export, args=(export, q, total), daemon=True)
+            feeder.start()
+        self.range_workers = list()
+        listers = list()
+        try:
+            ranges = [(cur_page, total_pages)]
+            if page_workers > 1 and self.browser_pool is not None:
+                # 当前driver占着一个浏览器, 分段数不超过池里空闲的浏览器数+1, 批量任务共用一个池时不会互相等死
+                ranges = self.split_pages(cur_page, total_pages, min(page_workers, 1 + self.browser_pool.available()))
+            self.pipeline["unleased"] = list()
+            for start, end in ranges[1:]:
+                t = threading.Thread(target=self.run_range, args=(start, end, total, q), daemon=True)
+                t.start()
+                listers.append(t)
+            if len(ranges) > 0:
+                self.list_pages(self, ranges[0][0], ranges[0][1], total, q)
+            for t in listers:
+                t.join()
+            # 没借到浏览器的段由当前driver接着翻
+            for start, end in self.pipeline["unleased"]:
+                if not self.go:
+                    break
+                self.jump_to_page(start)
+                self.list_pages(self, start, end, total, q)
+        finally:
+            for t in listers:
+                t.join()
+            self.pipeline["listed"] = True
+            if feeder is not None:
+                feeder.join()
+            for _ in workers:
+                q.put(None)
+            for w in workers:
+                w.join()
+            self.store.flush()
+
+    # spider(本spider或翻页分身)用自己的driver翻[start, end)页, 结果行放进共享队列
+    def list_pages(self, spider, start, end, total, q):
+        cur_page = start
+        while cur_page < end and self.go and not self.pipeline["exported"]:
+            # 指标请求的cookies只取自主浏览器, 避免几个浏览器的会话来回覆盖
+            if spider is self:
+                self.http.update_cookies(spider.driver.get_cookies())
+            rest = min(self.perpage, total - cur_page * self.perpage)
+            if self.recorder is not None:
+                self.recorder.record_page(cur_page, spider.driver.page_source)
+            with self.telemetry.stage("page_parse"):
+                tasks = [t for t in self.build_tasks(spider.page_rows(), cur_page, rest) if self.claim(t)]
+            self.register_page(cur_page, rest, len(tasks))
+            for task in tasks:
+                q.put(task)
+            if cur_page != end - 1:
+                with self.telemetry.stage("page_turn"):
+                    spider.next_page()
+            cur_page += 1
+        # csv已经覆盖了剩下的页, 这些页不用再打开, 只登记下来让游标能够推进
+        while cur_page < end and self.go:
+            self.register_page(cur_page, min(self.perpage, total - cur_page * self.perpage), 0)
+            cur_page += 1
+
+    # 把[start, end)页尽量平均地分成n段连续的页
+    @staticmethod
+    def split_pages(start, end, n):
+        pages = end - start
+        n = max(1, min(n, pages))
+        size = int(math.ceil(pages / n)) if pages > 0 else 0
+        return [(a, min(a + size, end)) for a in range(start, end, size)] if size > 0 else []
+
+    # 翻页分身: 共用断点库、连接池、流水线状态, 只有driver是从池里单独借的
+    def range_worker(self):
+        worker = copy.copy(self)
+        worker.lease = None
+        worker.driver = None
+        worker.own_pool = False
+        worker.range_workers = list()
+        return worker
+
+    # 借一个浏览器, 重新检索后跳到start页, 翻完[start, end); 借不到浏览器时交回给当前driver,
+    # 翻页中出错时这一段没登记的页留给下次续爬
+    def run_range(self, start, end, total, q):
+        worker = self.range_worker()
+        with self.pipeline_lock:
+            self.range_workers.append(worker)
+        try:
+            worker.start_driver(self.lease_timeout)
+        except queue.Empty:
+            print("没有空闲的浏览器, 第" + str(start + 1) + "-" + str(end) + "页改由当前浏览器翻页")
+            with self.pipeline_lock:
+                self.pipeline["unleased"].append((start, end))
+            return
+        try:
+            worker.login()
+            worker.submit_search(self.search, new_form=True)
+            worker.wait_page_change()
+            if start > 0:
+                worker.jump_to_page(start)
+            print("第" + str(start + 1) + "-" + str(end) + "页由另一个浏览器翻页")
+            self.list_pages(worker, start, end, total, q)
+            worker.release_driver()
+        except Exception:
+            traceback.print_exc()
+            worker.release_driver(broken=True)
+
+    # 等导出的csv下载完成后分块读取, 把没爬过也不在途的论文放进队列; 翻页先结束时不再等待下载
+    def feed_export(self, export, q, total):
+        path = export.wait(cancel=lambda: not self.go or self.pipeline["listed"])
+        if path is None:
+            return
+        print("导出文件已下载:" + path)
+        n = 0
+        chunks = su.iter_id_chunks(path, encoding=export.encoding)
+        while self.go:
+            with self.telemetry.stage("export_read"):
+                rows = next(chunks, None)
+            if rows is None:
+                break
+            for task in rows:
+                index, eid = task[0], task[1]
+                n += 1
+                if eid == "" or index >= total or self.store.is_done(index) or self.store.has_eid(eid):
+                    continue
+                if not self.claim(task):
+                    continue
+                self.add_pending(index // self.perpage, 1)
+                q.put(task)
+        # 行数与总条数一致才说明csv覆盖了全部结果, 之后翻页线程可以直接停下
+        if self.go and n == total:
+            self.pipeline["exported"] = True
+
+    # 占用一条任务, 序号或EID已被另一边放进队列时返回False
+    def claim(self, task):
+        index, eid = task[0], task[1]
+        with self.pipeline_lock:
+            state = self.pipeline
+            if eid != "" and eid in state["claimed_eids"]:
+                return False
+            if index in state["claimed"]:
+                if state["claimed"][index] != eid:
+                    print("第" + str(index) + "条在结果页和导出csv中不一致: " + state["claimed"][index] + " / " + eid)
+                return False
+            state["claimed"][index] = eid
+            if eid != "":
+                state["claimed_eids"].add(eid)
+            return True
+
+    def add_pending(self, page, n):
+        with self.pipeline_lock:
+            self.pipeline["pending"][page] = self.pipeline["pending"].get(page, 0) + n
+
+    def register_page(self, page, rest, n):
+        with self.pipeline_lock:
+            self.pipeline["rest"][page] = rest
+            self.pipeline["pending"][page] = self.pipeline["pending"].get(page, 0) + n
+        self.advance_cursor()
+
+    def consume(self, q):
+        while True:
+            task = q.get()
+            if task is None:
+                return
+            # 单条出错(如断点库被锁)时只算这一条失败, 线程继续消费, 否则队列满后翻页会一直阻塞
+            index, PlumXdetail = task[0], None
             try:
-                PlumXdetail_url = "https://plu.mx/api/v1/artifact/id/" + pre_json["plumXMetrics"]["link"].split("/")[-1]
-            except:
-                print(pre_json)
+                index, PlumXdetail = self.resolve_metrics(task)
+            except Exception:
                 traceback.print_exc()
-                continue
+            page = index // self.perpage
+            with self.pipeline_lock:
+                self.pipeline["pending"][page] -= 1
+                page_finished = self.pipeline["pending"][page] == 0
+            if PlumXdetail is not None:
+                print(PlumXdetail)
+                print("正在爬取第" + str(page + 1) + "页, 第" + str(index) + "条, 完成度:" + str(
+                    math.ceil(len(self.store) / self.pipeline["total"] * 100)) + "%..." + self.speed_text())
+            if page_finished:
+                self.advance_cursor()
+
+    # 只有该页及之前所有页都已完成时才推进游标, 有失败条目的页下次会重新处理
+    def advance_cursor(self):
+        with self.pipeline_lock:
+            state = self.pipeline
+            page = state["done_page"] + 1
+            moved = False
+            while page in state["rest"] and state["pending"].get(page) == 0 and \
+                    self.page_done(page, state["rest"][page]):
+                state["done_page"] = page
+                moved = True
+                page += 1
+            if moved:
+                self.store.flush()
+                self.store.save_cursor(self.search, state["done_page"], state["total"])
+                self.telemetry.dump(self.telemetry_path)
 
-            PlumXdetail_json_str = self.get_html_by_requests(PlumXdetail_url, cookies)
+    def page_done(self, page, rest):
+        start = self.perpage * page
+        return all(self.store.is_done(i) for i in range(start, start + rest))
+
+    # 跳到第page页(从0开始): 优先改结果页URL的offset参数, 不行就只点下一页而不解析页面
+    def jump_to_page(self, page):
+        url = self.driver.current_url
+        if "results.uri" in url:
+            parts = urlparse(url)
+            params = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k != "offset"]
+            params.append(("offset", str(self.perpage * page + 1)))
             try:
-                PlumXdetail = su.resolve_json(PlumXdetail_json_str)
-            except:
-                print(PlumXdetail_json_str)
+                self.driver.get(urlunparse(parts._replace(query=urlencode(params))))
+                self.wait_page_change()
+                self.count_page()
+                return
+            except Exception:
                 traceback.print_exc()
+                self.driver.get(url)
+                self.wait_page_change()
+        for _ in range(page):
+            self.next_page()
+
+    def page_key(self):
+        try:
+            return self.driver.execute_script(PAGE_KEY_JS)
+        except WebDriverException:
+            return None
+
+    # 等到结果页第一行与old_key不同, 即新的一页已经出现, 返回新的第一行链接; old_key为None时只等结果行出现.
+    # 超过page_timeout秒仍未变化时抛出TimeoutException, 不去解析旧页面
+    def wait_page_change(self, old_key=None, timeout=None):
+        def changed(driver):
+            key = self.page_key()
+            if key is None or key == old_key:
+                return False
+            return key
+        return WebDriverWait(self.driver, timeout or self.page_timeout, poll_frequency=0.1).until(
+            changed, "等待结果页超时")
+
+    def next_page(self):
+        old_key = self.page_key()
+        self.driver.execute_script("setSelectedLink('NextPageButton');")  # 翻页
+        self.count_page()
+        return self.wait_page_change(old_key)
+
+    # 浏览器池按累计翻页数决定何时重启浏览器
+    def count_page(self):
+        if self.lease is not None:
+            self.lease.pages += 1
+
+    def stop(self):
+        self.go = False
+        for worker in list(self.range_workers):
+            worker.release_driver(broken=True)
+        self.release_driver(broken=True)
+
+    def resolve_html(self, html, page, total, rest=50, cookies=""):
+        return self.fetch_metrics(self.parse_rows(html, page, rest), page, total, cookies)
+
+    # 解析结果页, 返回还没爬过的[(index, eid, 标题, doi)]
+    def parse_rows(self, html, page, rest=50):
+        return self.build_tasks(su.extract_rows(html), page, rest)
+
+    # rows为[(行号, 链接, eid, 标题)], 返回还没爬过的[(index, eid, 标题, doi)]
+    def build_tasks(self, rows, page, rest=50):
+        rows = {row[0]: row for row in rows}
+        tasks = list()
+        for i in range(0, rest):
+            if i not in rows:
+                print("缺少resultDataRow" + str(i))
+                continue
+            _, paper_info_url, eid, paper_title = rows[i]
+            index = self.perpage * (page) + i
+            if self.store.is_done(index):
                 continue
-            PlumXdetail["paper_title"] = paper_title
-            with open(os.path.join(save_path, str(self.perpage * (page) + i) + ".pickle"), "wb") as f:
-                pickle.dump(PlumXdetail, f)
-            print(PlumXdetail)
-            PlumXdetails.append(PlumXdetail)
-            print("正在爬取第" + str(page + 1) + "页, 第" + str(self.perpage * (page) + i) + "条, 完成度:" + str(
-                math.ceil((self.perpage * (page) + i + 1) / total * 100)) + "%...")
-        return PlumXdetails
+            tasks.append((index, eid, paper_title, ""))
+        return tasks
 
-    def get_html_by_requests(self, url, cookies=dict()):
-        header = {
-            "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/92.0.4515.131 Safari/537.36",
-        }
-        h = ""
-        while True:
+    # 当前结果页的所有行; script模式在页面内执行脚本只取回行数据, 失败时退回到解析page_source
+    def page_rows(self):
+        if self.extract_mode == "script":
             try:
-                proxies_click = False
-                print("开始请求:" + url)
-                if proxies_click:
-                    proxies = {"http": "http://127.0.0.1:7890", "https": "http://127.0.0.1:7890"}
-                    r = requests.get(url, headers=header, cookies=cookies, proxies=proxies, verify=False, timeout=5)
-                else:
-                    r = requests.get(url, headers=header, cookies=cookies, verify=False, timeout=5)
-                print("请求成功")
-                break
-            except:
-                print("请求失败, 继续")
+                rows = json.loads(self.driver.execute_script(EXTRACT_ROWS_JS))
+                if len(rows) > 0:
+                    return [(i, href, su.eid_from_url(href), title) for i, href, title in rows]
+            except Exception:
                 traceback.print_exc()
-                time.sleep(1)
-                continue
+        return su.extract_rows(self.driver.page_source)
+
+    # 并发请求一页内所有论文的指标, 同时在途的请求数不超过max_workers
+    def fetch_metrics(self, tasks, page, total, cookies="", keyed=False):
+        PlumXdetails = list()
+        if len(tasks) == 0:
+            return PlumXdetails
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self.resolve_metrics, task, cookies, keyed) for task in tasks]
+            for future in as_completed(futures):
+                index, PlumXdetail = future.result()
+                if PlumXdetail is None:
+                    continue
+                PlumXdetails.append((index, PlumXdetail))
+                print(PlumXdetail)
+                print("正在爬取第" + str(page + 1) + "页, 第" + str(index) + "条, 完成度:" + str(
+                    math.ceil((index + 1) / total * 100)) + "%..." + self.speed_text())
+        self.store.flush()
+        PlumXdetails.sort(key=lambda x: x[0])
+        return [d for _, d in PlumXdetails]
+
+    # 单条论文的两跳请求: documentsfacade取PlumX id, 再请求plu.mx, 成功后写入断点库;
+    # keyed为True时按EID/DOI保存, 不占用结果序号
+    def resolve_metrics(self, task, cookies="", keyed=False):
+        index, eid, paper_title, doi = task
+        if not self.go:
+            return index, None
+        PlumXdetail = None
+        # doi解析方式: 已知DOI时直接按DOI查plu.mx, 查不到(请求失败或没有指标)再走EID两跳
+        if self.resolver == "doi" and doi:
+            PlumXdetail = self.fetch_artifact(self.plumx_doi_url.format(quote(doi, safe="/")), cookies)
+            if PlumXdetail is None and eid:
+                print("按DOI查询失败, 改用EID:" + doi)
+        if PlumXdetail is None and eid:
+            PlumXdetail_url = self.plumx_url(eid, cookies)
+            if PlumXdetail_url is not None:
+                PlumXdetail = self.fetch_artifact(PlumXdetail_url, cookies)
+        if PlumXdetail is None:
+            return index, None
+        PlumXdetail["paper_title"] = paper_title
+        with self.telemetry.stage("checkpoint_write"):
+            if keyed:
+                self.store.put_keyed(eid or doi, eid, PlumXdetail)
+            else:
+                self.store.put(index, eid, PlumXdetail)
+        self.telemetry.record_done()
+        return index, PlumXdetail
+
+    def fetch_artifact(self, url, cookies=""):
+        PlumXdetail_json_str = ""
+        try:
+            with self.telemetry.stage("plumx_hop"):
+                PlumXdetail_json_str = self.get_html_by_requests(url, cookies)
+            PlumXdetail = su.resolve_json(PlumXdetail_json_str)
+        except:
+            print(PlumXdetail_json_str)
+            traceback.print_exc()
+            return None
+        # 没有sort_count的响应解析出来是空的, 当作没查到: 不写断点库(下次重试), 也不留在缓存里
+        if not PlumXdetail:
+            if self.cache is not None:
+                self.cache.delete(url)
+            return None
+        return PlumXdetail
 
+    # 第一跳: 通过documentsfacade拿到PlumX artifact的URL, 失败返回None; EID对应的PlumX id会记入断点库, 之后不再请求这一跳
+    def plumx_url(self, eid, cookies=""):
+        plumx_id = self.store.get_plumx_id(eid)
+        if plumx_id is not None:
+            return self.plumx_id_url.format(plumx_id)
+        pre_url = self.metrics_url.format(eid)
+        r_json = ""
+        try:
+            with self.telemetry.stage("metrics_hop"):
+                r_json = self.get_html_by_requests(pre_url, cookies)
+            pre_json = json.loads(r_json)
+            plumx_id = pre_json["plumXMetrics"]["link"].split("/")[-1]
+        except:
+            print(r_json)
+            traceback.print_exc()
+            plumx_id = ""
+        # 没拿到PlumX id的响应(登录页、没有plumXMetrics.link等)不留在缓存里, 下次重新请求
+        if plumx_id == "":
+            if self.cache is not None:
+                self.cache.delete(pre_url)
+            return None
+        self.store.put_plumx_id(eid, plumx_id)
+        return self.plumx_id_url.format(plumx_id)
+
+    # 增量刷新: 只重新请求断点库中已有的记录, plu.mx用条件请求, 指标有变化的记录才更新
+    def refresh(self):
+        self.login_cookies()
+        items = [(index, eid, record) for index, eid, record in self.store.iter_records() if eid or record.get("doi")]
+        stats = Counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for result in executor.map(self.refresh_record, items):
+                stats[result] += 1
+        self.store.flush()
+        self.close_http()
+        print("刷新完成:" + str(dict(stats)))
+        return dict(stats)
+
+    def refresh_record(self, item):
+        index, eid, old = item
+        if not self.go:
+            return "skipped"
+        if (self.resolver == "doi" or not eid) and old.get("doi"):
+            PlumXdetail_url = self.plumx_doi_url.format(quote(old["doi"], safe="/"))
+        else:
+            PlumXdetail_url = self.plumx_url(eid)
+        if PlumXdetail_url is None:
+            return "failed"
+        try:
+            PlumXdetail_json_str, changed = self.get_html_conditional(PlumXdetail_url)
+            if not changed:
+                return "not_modified"
+            PlumXdetail = su.resolve_json(PlumXdetail_json_str)
+        except:
+            traceback.print_exc()
+            return "failed"
+        # 没有sort_count的响应(出错或临时返回的内容)解析出来是空的, 保留原有记录
+        if "doi" not in PlumXdetail:
+            return "failed"
+        PlumXdetail["paper_title"] = old.get("paper_title")
+        if PlumXdetail == old:
+            return "unchanged"
+        self.store.put(index, eid, PlumXdetail)
+        return "updated"
+
+    def get_html_by_requests(self, url, cookies=dict()):
+        if self.cache is not None:
+            body = self.cache.get(url)
+            if body is not None:
+                return body.decode("utf-8")
+        print("开始请求:" + url)
+        r = self.http.fetch(url, cookies)
+        print("请求成功")
+        if self.cache is not None and r.status_code == 200:
+            self.cache.put(url, r.content, r.headers)
+        if self.recorder is not None:
+            self.recorder.record_response(url, r.status_code, r.content)
         h = r.content.decode("utf-8")
         return h
 
-    def read_pick(self, file_dir):
-        pickles = os.listdir(file_dir)
+    # 条件请求: 带上缓存中的ETag/Last-Modified, 304时沿用缓存内容并刷新其有效期; 返回(响应文本, 是否有变化)
+    def get_html_conditional(self, url, cookies=dict()):
+        entry = self.cache.load(url) if self.cache is not None else None
+        headers = dict()
+        if entry is not None:
+            cached_headers = {k.lower(): v for k, v in entry["headers"].items()}
+            if "etag" in cached_headers:
+                headers["If-None-Match"] = cached_headers["etag"]
+            if "last-modified" in cached_headers:
+                headers["If-Modified-Since"] = cached_headers["last-modified"]
+        print("开始条件请求:" + url)
+        r = self.http.fetch(url, cookies, headers=headers)
+        if r.status_code == 304 and entry is not None:
+            self.cache.put(url, entry["body"], entry["headers"])
+            return entry["body"].decode("utf-8"), False
+        if self.cache is not None and r.status_code == 200:
+            self.cache.put(url, r.content, r.headers)
+        return r.content.decode("utf-8"), True
 
+    # file_dir为旧版本的pickles目录, 其中尚未导入的记录会先并入断点库
+    def read_pick(self, file_dir=None):
+        if file_dir:
+            self.store.import_pickles(file_dir)
         objs = list()
-        for p in pickles:
-            if "pickle" in p:
-                pickle_path = os.path.join(file_dir, p)
-                f = open(pickle_path, "rb")
-                obj = pickle.load(f)
-                if "doi" in obj.keys():
-                    objs.append(obj)
+        for obj in self.store:
+            if "doi" in obj.keys():
+                objs.append(obj)
         is_dup = self.check_duplicate(objs)
         su.reset_dict(objs, os.path.join(self.download_path, "plumx.csv"))
 
+    # 把导出的scopus.csv和plumx.csv按doi合并成scopus_plumx.csv
+    def merge_export(self, export, timeout=60):
+        path = export.wait(timeout=timeout, cancel=lambda: not self.go)
+        plumx = os.path.join(self.download_path, "plumx.csv")
+        if path is None or not os.path.exists(plumx):
+            return
+        with self.telemetry.stage("merge"):
+            su.merge_scopus_with_spider_data(path, plumx, os.path.join(self.download_path, "scopus_plumx.csv"))
+
     def check_duplicate(self, objs):
         origin_len = len(objs)
         tmp = set()
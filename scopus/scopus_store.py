@@ -0,0 +1,200 @@
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+
+class CheckpointStore(object):
+    """
+    单文件的爬取断点库(SQLite WAL), 按结果序号index保存每条论文的PlumX数据, 取代tmp/pickles下的单条pickle
+    """
+    def __init__(self, path, batch_size=50):
+        self.path = path
+        self.batch_size = batch_size
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS records ("
+                          "idx INTEGER PRIMARY KEY, eid TEXT, doi TEXT, data BLOB, updated REAL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS records_eid ON records(eid)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS records_doi ON records(doi)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS plumx_ids (eid TEXT PRIMARY KEY, plumx_id TEXT)")
+        # 不属于本次检索结果列表的论文(共享队列领到的任务、任意csv/列表文件)按EID(没有时用DOI)保存, 不占用结果序号
+        self.conn.execute("CREATE TABLE IF NOT EXISTS keyed ("
+                          "key TEXT PRIMARY KEY, eid TEXT, doi TEXT, data BLOB, updated REAL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS keyed_eid ON keyed(eid)")
+        self.conn.commit()
+        # 启动时把已完成的index和eid读进内存, "是否已爬取"的判断不再访问磁盘
+        self.done = set()
+        self.done_eids = set()
+        for idx, eid in self.conn.execute("SELECT idx, eid FROM records"):
+            self.done.add(idx)
+            if eid:
+                self.done_eids.add(eid)
+        # EID -> PlumX artifact id, 不会变化, 有了就可以省掉documentsfacade那一跳
+        self.plumx_ids = dict(self.conn.execute("SELECT eid, plumx_id FROM plumx_ids"))
+        self.done_keys = set(row[0] for row in self.conn.execute("SELECT key FROM keyed"))
+        self.pending = list()
+        self.pending_ids = list()
+        self.pending_keyed = list()
+
+    def is_done(self, index):
+        return index in self.done
+
+    def has_eid(self, eid):
+        return eid in self.done_eids
+
+    def has_key(self, key):
+        return key in self.done_keys
+
+    def __len__(self):
+        return len(self.done)
+
+    def put(self, index, eid, record):
+        with self.lock:
+            self.pending.append((index, eid, record.get("doi"), pickle.dumps(record), time.time()))
+            self.done.add(index)
+            if eid:
+                self.done_eids.add(eid)
+            if len(self.pending) >= self.batch_size:
+                self.flush()
+
+    # key为EID或DOI
+    def put_keyed(self, key, eid, record):
+        with self.lock:
+            self.pending_keyed.append((key, eid, record.get("doi"), pickle.dumps(record), time.time()))
+            self.done_keys.add(key)
+            if len(self.pending_keyed) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        with self.lock:
+            if len(self.pending) == 0 and len(self.pending_ids) == 0 and len(self.pending_keyed) == 0:
+                return
+            self.conn.executemany("INSERT OR REPLACE INTO records (idx, eid, doi, data, updated) VALUES (?, ?, ?, ?, ?)",
+                                  self.pending)
+            self.conn.executemany("INSERT OR REPLACE INTO plumx_ids (eid, plumx_id) VALUES (?, ?)", self.pending_ids)
+            self.conn.executemany("INSERT OR REPLACE INTO keyed (key, eid, doi, data, updated) VALUES (?, ?, ?, ?, ?)",
+                                  self.pending_keyed)
+            self.conn.commit()
+            self.pending = list()
+            self.pending_ids = list()
+            self.pending_keyed = list()
+
+    def get_plumx_id(self, eid):
+        return self.plumx_ids.get(eid)
+
+    def put_plumx_id(self, eid, plumx_id):
+        with self.lock:
+            if self.plumx_ids.get(eid) == plumx_id:
+                return
+            self.plumx_ids[eid] = plumx_id
+            self.pending_ids.append((eid, plumx_id))
+            if len(self.pending_ids) >= self.batch_size:
+                self.flush()
+
+    def get(self, index):
+        with self.lock:
+            self.flush()
+            row = self.conn.execute("SELECT data FROM records WHERE idx = ?", (index,)).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def get_keyed(self, key):
+        with self.lock:
+            self.flush()
+            row = self.conn.execute("SELECT data FROM keyed WHERE key = ?", (key,)).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    # 先查按EID保存的记录, 再查结果列表中的记录
+    def get_by_eid(self, eid):
+        with self.lock:
+            self.flush()
+            row = self.conn.execute("SELECT data FROM keyed WHERE eid = ? LIMIT 1", (eid,)).fetchone()
+            if row is None:
+                row = self.conn.execute("SELECT data FROM records WHERE eid = ? LIMIT 1", (eid,)).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    # 按index顺序逐条返回(index, eid, record), 不会一次性读入全部数据
+    def iter_records(self, batch=500):
+        self.flush()
+        last = -1
+        while True:
+            with self.lock:
+                rows = self.conn.execute("SELECT idx, eid, data FROM records WHERE idx > ? ORDER BY idx LIMIT ?",
+                                         (last, batch)).fetchall()
+            if len(rows) == 0:
+                return
+            for idx, eid, data in rows:
+                yield idx, eid, pickle.loads(data)
+            last = rows[-1][0]
+
+    # 逐条返回按EID/DOI保存的(key, eid, record)
+    def iter_keyed(self, batch=500):
+        self.flush()
+        last = 0
+        while True:
+            with self.lock:
+                rows = self.conn.execute("SELECT rowid, key, eid, data FROM keyed WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                                         (last, batch)).fetchall()
+            if len(rows) == 0:
+                return
+            for _, key, eid, data in rows:
+                yield key, eid, pickle.loads(data)
+            last = rows[-1][0]
+
+    # 结果列表中的记录和按EID/DOI保存的记录
+    def __iter__(self):
+        for _, _, record in self.iter_records():
+            yield record
+        for _, _, record in self.iter_keyed():
+            yield record
+
+    def set_meta(self, key, value):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+            self.conn.commit()
+
+    def get_meta(self, key, default=None):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    # 翻页游标: 查询语句, 最后一个全部完成的页(从0开始, -1表示还没有)和总条数
+    def save_cursor(self, query, page, total):
+        self.set_meta("cursor", {"query": query, "page": page, "total": total})
+
+    def load_cursor(self, query=None):
+        cursor = self.get_meta("cursor")
+        if cursor is None or (query is not None and cursor["query"] != query):
+            return None
+        return cursor
+
+    # 导入旧版本留下的<index>.pickle文件; 导入过的目录记在meta里, 之后不再扫描, force=True时重新导入
+    def import_pickles(self, pickle_dir, force=False):
+        if not os.path.isdir(pickle_dir):
+            return 0
+        imported = self.get_meta("imported_pickles", [])
+        key = os.path.abspath(pickle_dir)
+        if key in imported and not force:
+            return 0
+        n = 0
+        for p in os.listdir(pickle_dir):
+            name, ext = os.path.splitext(p)
+            if ext != ".pickle" or not name.isdigit() or self.is_done(int(name)):
+                continue
+            with open(os.path.join(pickle_dir, p), "rb") as f:
+                self.put(int(name), None, pickle.load(f))
+            n += 1
+        self.flush()
+        if key not in imported:
+            self.set_meta("imported_pickles", imported + [key])
+        return n
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            self.conn.close()
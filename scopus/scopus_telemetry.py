@@ -0,0 +1,122 @@
+import json
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+# 延迟直方图的桶上界(秒)
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, float("inf")]
+
+
+class Telemetry(object):
+    """
+    爬虫运行数据: 各阶段耗时、各host请求延迟直方图和错误数、滚动吞吐量和预计剩余时间, 可以随时snapshot()或dump()成json
+    """
+    def __init__(self, window=60.0):
+        self.window = window
+        self.started = time.time()
+        self.stages = dict()
+        self.latencies = dict()
+        self.errors = dict()
+        self.done_times = deque()
+        self.done = 0
+        self.total = 0
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - t)
+
+    def add_stage(self, name, seconds):
+        with self.lock:
+            s = self.stages.get(name)
+            if s is None:
+                s = {"count": 0, "total": 0.0, "min": seconds, "max": seconds}
+                self.stages[name] = s
+            s["count"] += 1
+            s["total"] += seconds
+            s["min"] = min(s["min"], seconds)
+            s["max"] = max(s["max"], seconds)
+
+    def observe_latency(self, host, seconds):
+        with self.lock:
+            h = self.latencies.get(host)
+            if h is None:
+                h = {"count": 0, "total": 0.0, "buckets": [0] * len(LATENCY_BUCKETS)}
+                self.latencies[host] = h
+            h["count"] += 1
+            h["total"] += seconds
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    h["buckets"][i] += 1
+                    break
+
+    def error(self, host, kind):
+        with self.lock:
+            self.errors.setdefault(host, Counter())[kind] += 1
+
+    # total为总条数, done为启动时已完成的条数
+    def set_total(self, total, done=0):
+        with self.lock:
+            self.total = total
+            self.done = done
+
+    def record_done(self, n=1):
+        now = time.time()
+        with self.lock:
+            self.done += n
+            for _ in range(n):
+                self.done_times.append(now)
+            while self.done_times and now - self.done_times[0] > self.window:
+                self.done_times.popleft()
+
+    # 最近window秒内的条/秒
+    def throughput(self):
+        now = time.time()
+        with self.lock:
+            while self.done_times and now - self.done_times[0] > self.window:
+                self.done_times.popleft()
+            n = len(self.done_times)
+        span = min(self.window, now - self.started)
+        return n / span if span > 0 else 0.0
+
+    # 预计剩余秒数, 无法估计时返回None
+    def eta(self):
+        rate = self.throughput()
+        remaining = max(0, self.total - self.done)
+        if remaining == 0:
+            return 0.0
+        if rate <= 0:
+            return None
+        return remaining / rate
+
+    def snapshot(self):
+        rate = self.throughput()
+        eta = self.eta()
+        with self.lock:
+            stages = dict()
+            for name, s in self.stages.items():
+                stages[name] = dict(s, avg=s["total"] / s["count"])
+            latencies = dict()
+            for host, h in self.latencies.items():
+                buckets = {("le_" + str(b) if b != float("inf") else "le_inf"): c
+                           for b, c in zip(LATENCY_BUCKETS, h["buckets"])}
+                latencies[host] = {"count": h["count"], "avg": h["total"] / h["count"], "buckets": buckets}
+            return {
+                "elapsed": time.time() - self.started,
+                "done": self.done,
+                "total": self.total,
+                "throughput": rate,
+                "eta": eta,
+                "stages": stages,
+                "latency": latencies,
+                "errors": {host: dict(c) for host, c in self.errors.items()},
+            }
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
@@ -1,7 +1,17 @@
 import json
 import os
+import re
 
 import pandas as pd
+from bs4 import BeautifulSoup as BS, SoupStrainer
+
+try:
+    import lxml
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+RESULT_ROW_ID = re.compile(r"^resultDataRow(\d+)$")
 
 def resolve_json(json_str):
     origin = json.loads(json_str)
@@ -111,9 +121,23 @@ def save_dict_to_csv(data, col_names, path):
     df.to_csv(path, index=False)
 
 
-def merge_scopus_with_spider_data(f1, f2):
-
-    pass
+"""
+按doi把scopus导出的csv(f1)和爬到的plumx.csv(f2)合并, 没有爬到指标的论文保留元数据
+"""
+def merge_scopus_with_spider_data(f1, f2, path=None):
+    try:
+        scopus = pd.read_csv(f1, encoding="utf-8", dtype=str)
+    except UnicodeDecodeError:
+        scopus = pd.read_csv(f1, encoding="gbk", dtype=str)
+    scopus.columns = [c.strip().lstrip("\ufeff") for c in scopus.columns]
+    plumx = pd.read_csv(f2, encoding="utf-8").drop(columns=["paper_title"], errors="ignore")
+    plumx = plumx.drop_duplicates(subset=["doi"])
+    scopus["doi"] = scopus["DOI"].fillna("").str.strip().str.lower()
+    plumx["doi"] = plumx["doi"].fillna("").astype(str).str.strip().str.lower()
+    df = scopus.merge(plumx[plumx["doi"] != ""], on="doi", how="left").drop(columns=["doi"])
+    if path is not None:
+        df.to_csv(path, index=False)
+    return df
 
 
 
@@ -218,6 +242,75 @@ def merge_plumx_test():
     reset_dict(test_case)
 
 
+"""
+一次解析结果页, 只构建id为resultDataRow<i>的行, 返回[(行号i, 链接, eid, 标题)]
+"""
+def extract_rows(html):
+    soup = BS(html, HTML_PARSER, parse_only=SoupStrainer("tr", id=RESULT_ROW_ID))
+    rows = list()
+    for tr in soup.find_all("tr", id=RESULT_ROW_ID):
+        m = RESULT_ROW_ID.match(tr["id"])
+        td = tr.find("td", attrs={"data-type": "docTitle"})
+        if td is None or td.a is None:
+            continue
+        href = td.a.get("href", "")
+        rows.append((int(m.group(1)), href, eid_from_url(href), str(td.a.string)))
+    return rows
+
+
+def eid_from_url(url):
+    if "?" not in url:
+        return ""
+    for p in url.split("?")[1].split("&"):
+        if "eid" in p:
+            return p.split("=")[1]
+    return ""
+
+
+"""
+读取EID/DOI列表: scopus导出的csv(EID, DOI, Title列), 或每行一个EID(以2-s2.0-开头)/DOI的文本文件
+返回[(序号, eid, 标题, doi)]
+"""
+def read_id_list(path):
+    rows = list()
+    if path.lower().endswith(".csv"):
+        try:
+            df = pd.read_csv(path, encoding="utf-8", dtype=str)
+        except UnicodeDecodeError:
+            df = pd.read_csv(path, encoding="gbk", dtype=str)
+        return id_rows(df)
+    with open(path, encoding="utf-8") as f:
+        for line in f.readlines():
+            v = line.strip()
+            if v == "":
+                continue
+            if v.startswith("2-s2.0-"):
+                rows.append((len(rows), v, "", ""))
+            else:
+                rows.append((len(rows), "", "", v))
+    return rows
+
+
+def id_rows(df, start=0):
+    df = df.fillna("")
+    df.columns = [c.strip().lstrip("\ufeff") for c in df.columns]
+    rows = list()
+    for i, line in enumerate(df.to_dict("records")):
+        rows.append((start + i, line.get("EID", "").strip(), line.get("Title", ""), line.get("DOI", "").strip()))
+    return rows
+
+
+"""
+分块读取scopus导出的csv, 每次返回chunksize条[(序号, eid, 标题, doi)], 序号即在csv中的行号
+"""
+def iter_id_chunks(path, chunksize=500, encoding="utf-8"):
+    start = 0
+    for df in pd.read_csv(path, encoding=encoding, dtype=str, chunksize=chunksize):
+        rows = id_rows(df, start)
+        start += len(df)
+        yield rows
+
+
 """
 合并所有scopus文件
 """
@@ -0,0 +1,118 @@
+import itertools
+import os
+import time
+
+from scopus.scopus_browser import BrowserPool
+from scopus.scopus_spider import ScopusSpider
+
+ids = itertools.count()
+
+
+class FakeDriver(object):
+    def __init__(self):
+        self.id = next(ids)
+        self.alive = True
+        self.current_url = "https://www.scopus.com/results/results.uri"
+
+    def execute_script(self, script, *args):
+        if not self.alive:
+            raise RuntimeError("driver closed")
+        return 1
+
+    def execute_cdp_cmd(self, cmd, params):
+        return {}
+
+    def quit(self):
+        self.alive = False
+
+
+def fake_start(monkeypatch):
+    original = ScopusSpider.start_driver
+
+    def start_driver(self):
+        if self.browser_pool is None:
+            time.sleep(0.05)
+            self.driver = FakeDriver()
+        else:
+            original(self)
+    monkeypatch.setattr(ScopusSpider, "start_driver", start_driver)
+    monkeypatch.setattr(ScopusSpider, "login", lambda self: None)
+
+
+def test_pool_warms_in_background(tmp_path, monkeypatch):
+    fake_start(monkeypatch)
+    pool = BrowserPool(str(tmp_path), "u", "p", size=2)
+    pool.warm()
+    assert all(BrowserPool.healthy(slot) for slot in pool.slots)
+    started = [slot.driver.id for slot in pool.slots]
+    # 已经启动的浏览器不会被再次预热
+    pool.warm()
+    assert [slot.driver.id for slot in pool.slots] == started
+    pool.close()
+
+
+def test_pool_reuses_and_recycles_drivers(tmp_path, monkeypatch):
+    fake_start(monkeypatch)
+    pool = BrowserPool(str(tmp_path), "u", "p", size=1, max_pages=3).warm()
+    spider = ScopusSpider(str(tmp_path / "job"), "q", "u", "p", browser_pool=pool, cache_dir=False)
+    spider.start_driver()
+    first = spider.driver
+    spider.count_page()
+    spider.release_driver()
+    spider.start_driver()
+    assert spider.driver is first
+    spider.lease.pages += 2
+    spider.release_driver()
+    lease = pool.acquire(timeout=5)
+    assert lease.driver is not first and not first.alive
+    lease.driver.alive = False
+    pool.release(lease)
+    lease = pool.acquire(timeout=5)
+    assert lease.driver.alive
+    pool.release(lease)
+    pool.close()
+
+
+class LoginDriver(FakeDriver):
+    """
+    登录流程中的页面: 停在id.elsevier.com的登录表单上, 没有scopus首页的登录链接
+    """
+    def __init__(self):
+        super(LoginDriver, self).__init__()
+        self.current_url = "https://id.elsevier.com/as/authorization.oauth2"
+        self.typed = list()
+
+    def get(self, url):
+        pass
+
+    def execute_script(self, script, *args):
+        return True
+
+    def get_cookies(self):
+        return [{"name": "SCSessionID", "value": "1"}]
+
+    def find_elements_by_id(self, id):
+        return list()
+
+    def find_element_by_id(self, id):
+        driver = self
+
+        class Element(object):
+            def send_keys(self, value):
+                driver.typed.append((id, value))
+
+            def click(self):
+                if id == "bdd-elsPrimaryBtn" and len(driver.typed) == 2:
+                    driver.current_url = "https://www.scopus.com/search/form.uri"
+        return Element()
+
+
+def test_login_without_signin_link_fills_form(tmp_path):
+    spider = ScopusSpider(str(tmp_path / "job"), "q", "u", "p", cache_dir=False)
+    spider.driver = LoginDriver()
+    assert not spider.logged_in()
+    spider.login()
+    assert spider.driver.typed == [("bdd-email", "u"), ("bdd-password", "p")]
+    assert spider.logged_in()
+    assert os.path.exists(spider.session_path)
+    spider.store.close()
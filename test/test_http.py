@@ -0,0 +1,48 @@
+import time
+
+from scopus.scopus_cache import normalize_url
+from scopus.scopus_http import CircuitBreaker, RetryPolicy, parse_retry_after
+
+
+def test_breaker_opens_after_threshold_and_probes_once():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.1)
+    assert breaker.allow("h")
+    assert not breaker.record_failure("h")
+    assert breaker.record_failure("h")
+    assert breaker.state("h") == "open"
+    assert not breaker.allow("h")
+    assert breaker.remaining("h") > 0
+    time.sleep(0.15)
+    assert breaker.state("h") == "half-open"
+    assert breaker.allow("h")
+    assert not breaker.allow("h")
+    breaker.record_success("h")
+    assert breaker.state("h") == "closed"
+    assert breaker.allow("h")
+
+
+def test_breaker_failed_probe_reopens():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure("h")
+    time.sleep(0.06)
+    assert breaker.allow("h")
+    assert breaker.record_failure("h")
+    assert breaker.state("h") == "open"
+
+
+def test_retry_delay_is_capped():
+    policy = RetryPolicy(base_delay=1.0, max_delay=5.0, jitter=0.0)
+    assert policy.delay(0) == 1.0
+    assert policy.delay(10) == 5.0
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+
+
+def test_normalize_url():
+    assert normalize_url("HTTPS://Plu.MX:443/api/a?b=2&a=1#frag") == "https://plu.mx/api/a?a=1&b=2"
+    assert normalize_url("http://example.com:80") == "http://example.com/"
+    assert normalize_url("http://example.com:8080/x") == "http://example.com:8080/x"
@@ -0,0 +1,173 @@
+import os
+
+import pytest
+
+from scopus.scopus_replay import generate_fixtures, FakeScopusServer, ReplayDriver
+from scopus.scopus_spider import ScopusSpider
+
+TOTAL = 120
+
+
+@pytest.fixture(scope="module")
+def fixture_dir(tmp_path_factory):
+    d = str(tmp_path_factory.mktemp("fixtures"))
+    generate_fixtures(d, total=TOTAL)
+    return d
+
+
+@pytest.fixture
+def server(fixture_dir):
+    server = FakeScopusServer(fixture_dir, latency=0).start()
+    yield server
+    server.stop()
+
+
+def make_spider(work_path, fixture_dir, server, extract_mode="script"):
+    spider = ScopusSpider(work_path, "q", "", "", max_workers=4, rates={server.host: 1000.0},
+                          extract_mode=extract_mode, cache_dir=False, persist_session=False)
+    spider.metrics_url = server.base_url + "/documentsfacade/documents/{}/metrics"
+    spider.plumx_id_url = server.base_url + "/api/v1/artifact/id/{}"
+    spider.plumx_doi_url = server.base_url + "/api/v1/artifact/doi/{}"
+    spider.driver = ReplayDriver(fixture_dir)
+    return spider
+
+
+@pytest.mark.parametrize("extract_mode", ["script", "html"])
+def test_pipeline_stores_every_row(tmp_path, fixture_dir, server, extract_mode):
+    spider = make_spider(str(tmp_path / "work"), fixture_dir, server, extract_mode)
+    spider.run_pipeline(0, 3, TOTAL)
+    assert len(spider.store) == TOTAL
+    assert spider.store.load_cursor("q")["page"] == 2
+    record = spider.store.get(5)
+    assert record["doi"] == "10.9999/fake.5"
+    assert record["paper_title"] == "Paper 5"
+    spider.store.close()
+
+
+def test_pipeline_resume_skips_done_rows(tmp_path, fixture_dir, server):
+    work_path = str(tmp_path / "work")
+    spider = make_spider(work_path, fixture_dir, server)
+    spider.run_pipeline(0, 3, TOTAL)
+    spider.store.close()
+    spider = make_spider(work_path, fixture_dir, server)
+    spider.run_pipeline(0, 3, TOTAL)
+    assert spider.http.stats().get("requests", 0) == 0
+    assert len(spider.store) == TOTAL
+
+
+def test_pipeline_parallel_page_ranges(tmp_path, fixture_dir, server):
+    from scopus.scopus_replay import ReplayPool
+    spider = make_spider(str(tmp_path / "work"), fixture_dir, server)
+    spider.browser_pool = ReplayPool(fixture_dir)
+    spider.run_pipeline(0, 3, TOTAL, page_workers=3)
+    assert len(spider.store) == TOTAL
+    assert spider.store.load_cursor("q")["page"] == 2
+
+
+def test_pipeline_failed_rows_hold_the_cursor(tmp_path, fixture_dir):
+    server = FakeScopusServer(fixture_dir, latency=0, error_rate=1.0).start()
+    try:
+        spider = make_spider(str(tmp_path / "work"), fixture_dir, server)
+        spider.http.retry_policy.max_attempts = 1
+        spider.http.open_wait = 0
+        spider.run_pipeline(0, 3, TOTAL)
+        assert len(spider.store) == 0
+        assert spider.store.load_cursor("q") is None
+    finally:
+        server.stop()
+
+
+def write_export(spider, total):
+    with open(os.path.join(spider.download_path, "scopus.csv"), "w", encoding="utf-8") as f:
+        f.write("Title,DOI,EID\n")
+        for n in range(total):
+            f.write("Paper {0},10.9999/fake.{0},2-s2.0-{1}\n".format(n, 85000000000 + n))
+
+
+@pytest.mark.parametrize("error_rate,finished", [(1.0, False), (0.0, True)])
+def test_run_marks_finish_only_when_complete(tmp_path, fixture_dir, monkeypatch, error_rate, finished):
+    from scopus.scopus_jobs import job_finished
+    monkeypatch.chdir(str(tmp_path))
+    server = FakeScopusServer(fixture_dir, latency=0, error_rate=error_rate).start()
+    try:
+        work_path = str(tmp_path / "work")
+        spider = make_spider(work_path, fixture_dir, server)
+        spider.http.retry_policy.max_attempts = 1
+        spider.http.open_wait = 0
+        write_export(spider, TOTAL)
+        spider.start_driver = lambda: setattr(spider, "driver", ReplayDriver(fixture_dir))
+        spider.login = lambda: None
+        spider.run()
+        assert os.path.exists(os.path.join(spider.download_path, "finish")) == finished
+        assert job_finished(work_path) == finished
+    finally:
+        server.stop()
+
+
+def test_pipeline_lists_unleased_ranges_on_main_driver(tmp_path, fixture_dir, server):
+    from scopus.scopus_replay import ReplayPool
+    spider = make_spider(str(tmp_path / "work"), fixture_dir, server)
+    # 池里只有一个浏览器, 但available()报告有空闲, 模拟被其他任务抢先借走的情况
+    pool = ReplayPool(fixture_dir, page_delay=0.3, size=1)
+    pool.available = lambda: 2
+    spider.browser_pool = pool
+    spider.lease_timeout = 0.2
+    spider.run_pipeline(0, 3, TOTAL, page_workers=3)
+    assert len(spider.store) == TOTAL
+    assert spider.store.load_cursor("q")["page"] == 2
+
+
+def test_pipeline_caps_ranges_at_free_browsers(tmp_path, fixture_dir, server):
+    from scopus.scopus_replay import ReplayPool
+    spider = make_spider(str(tmp_path / "work"), fixture_dir, server)
+    spider.browser_pool = ReplayPool(fixture_dir, size=0)
+    spider.run_pipeline(0, 3, TOTAL, page_workers=3)
+    assert spider.range_workers == []
+    assert len(spider.store) == TOTAL
+
+
+def test_run_from_foreign_list_keeps_page_records(tmp_path, fixture_dir, server, monkeypatch):
+    spider = make_spider(str(tmp_path / "work"), fixture_dir, server)
+    spider.run_pipeline(0, 1, TOTAL)
+    page_record = spider.store.get(0)
+    # 另一个列表文件: 第0行不是检索结果的第0条, 第1行已经在检索结果里爬过
+    id_list = tmp_path / "ids.txt"
+    id_list.write_text("2-s2.0-" + str(85000000000 + 60) + "\n2-s2.0-" + str(85000000000 + 1) + "\n")
+    monkeypatch.setattr(spider, "login_cookies", lambda: None)
+    spider.run_from_csv(str(id_list))
+    assert spider.store.get(0) == page_record
+    assert spider.store.get_keyed("2-s2.0-" + str(85000000000 + 60))["doi"] == "10.9999/fake.60"
+    assert not spider.store.has_key("2-s2.0-" + str(85000000000 + 1))
+    spider.store.close()
+
+
+def test_metrics_response_without_plumx_link_is_not_cached(tmp_path, fixture_dir, server):
+    from scopus.scopus_cache import ResponseCache
+    spider = make_spider(str(tmp_path / "work"), fixture_dir, server)
+    spider.cache = ResponseCache(str(tmp_path / "cache"))
+    url = spider.metrics_url.format("2-s2.0-1")
+    spider.cache.put(url, b'{"plumXMetrics": {}}')
+    assert spider.plumx_url("2-s2.0-1") is None
+    assert spider.cache.get(url) is None
+    spider.store.close()
+
+
+def test_run_cleans_up_when_search_fails(tmp_path, fixture_dir, server):
+    from scopus.scopus_store import CheckpointStore
+    work_path = str(tmp_path / "work")
+    spider = make_spider(work_path, fixture_dir, server)
+    write_export(spider, TOTAL)
+    spider.start_driver = lambda: setattr(spider, "driver", ReplayDriver(fixture_dir))
+    spider.login = lambda: None
+    spider.store.put(0, "2-s2.0-1", {"doi": "10.1/a"})
+
+    def fail():
+        raise RuntimeError("no resultsCount")
+    spider.result_count = fail
+    with pytest.raises(RuntimeError):
+        spider.run()
+    assert spider.driver is None
+    spider.store.close()
+    store = CheckpointStore(os.path.join(spider.download_path, "checkpoint.db"))
+    assert len(store) == 1
+    store.close()
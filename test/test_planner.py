@@ -0,0 +1,107 @@
+import random
+import re
+
+import pytest
+from selenium.common.exceptions import TimeoutException
+
+from scopus.scopus_planner import QueryPlanner
+from scopus.scopus_spider import ScopusSpider
+
+
+def make_records(n=4000):
+    rng = random.Random(1)
+    return [{"year": rng.randint(2000, 2020), "doctype": rng.choice(["ar", "re", "cp", "xx"]),
+             "country": rng.choice(["China", "Germany", "Nowhere"])} for _ in range(n)]
+
+
+def matches(record, query):
+    m = re.search(r"PUBYEAR > (\d+) AND PUBYEAR < (\d+)", query)
+    if m and not int(m.group(1)) < record["year"] < int(m.group(2)):
+        return False
+    m = re.search(r"PUBYEAR = (\d+)", query)
+    if m and record["year"] != int(m.group(1)):
+        return False
+    for field, key in [("DOCTYPE", "doctype"), ("AFFILCOUNTRY", "country")]:
+        pattern = field + r"\(\"([^\"]+)\"\)"
+        for value in re.findall(r"(?<!NOT \()(?<!OR )" + pattern, query):
+            if record[key] != value:
+                return False
+        m = re.search(r"NOT \((" + field + r"[^)]*\)(?: OR " + field + r"[^)]*\))*)\)", query)
+        if m and record[key] in re.findall(pattern, m.group(1)):
+            return False
+    return True
+
+
+def test_plan_partitions_without_gaps_or_overlap():
+    records = make_records()
+    probes = list()
+
+    def probe(query):
+        probes.append(query)
+        return sum(1 for r in records if matches(r, query))
+
+    planner = QueryPlanner(probe, threshold=150, min_year=2000, max_year=2020,
+                           doctypes=["ar", "re", "cp"], countries=["China", "Germany"])
+    plan = planner.plan("TITLE(x)")
+    assert sum(c for _, c in plan) == len(records)
+    assert all(c > 0 for _, c in plan)
+    assert all(q.startswith("(TITLE(x)) AND ") for q, _ in plan)
+    # 每条记录只落在一个子查询里
+    for r in records[:200]:
+        assert sum(1 for q, _ in plan if matches(r, q)) == 1
+
+
+def test_plan_keeps_small_query_whole():
+    planner = QueryPlanner(lambda q: 10, threshold=100)
+    assert planner.plan(" TITLE(x) ") == [("TITLE(x)", 10)]
+
+
+def test_plan_skips_facets_already_in_query():
+    seen = list()
+
+    def probe(query):
+        seen.append(query)
+        return 500 if query == "PUBYEAR = 2010 AND DOCTYPE(ar)" else 50
+
+    plan = QueryPlanner(probe, threshold=100, countries=["China"]).plan("PUBYEAR = 2010 AND DOCTYPE(ar)")
+    assert all("AFFILCOUNTRY" in q for q, _ in plan)
+    assert not any("PUBYEAR >" in q for q in seen)
+
+
+class ProbeDriver(object):
+    def __init__(self, states):
+        self.states = list(states)
+        self.current_url = "https://www.scopus.com/results/results.uri"
+
+    def get(self, url):
+        pass
+
+    def find_element_by_id(self, id):
+        from scopus.scopus_replay import ReplayElement
+        return ReplayElement(self, id)
+
+    def find_element_by_class_name(self, name):
+        return type("Element", (object,), {"text": "1,234"})()
+
+    def execute_script(self, script, *args):
+        return self.states.pop(0) if len(self.states) > 1 else self.states[0]
+
+
+def make_probe_spider(tmp_path, states):
+    spider = ScopusSpider(str(tmp_path / "probe"), "", "", "", cache_dir=False, persist_session=False,
+                          page_timeout=0.3)
+    spider.driver = ProbeDriver(states)
+    return spider
+
+
+def test_count_results_waits_for_results_page(tmp_path):
+    assert make_probe_spider(tmp_path, [None, None, "results"]).count_results("q") == 1234
+
+
+def test_count_results_zero_only_when_page_says_so(tmp_path):
+    assert make_probe_spider(tmp_path, [None, "empty"]).count_results("q") == 0
+
+
+def test_count_results_raises_while_still_loading(tmp_path):
+    with pytest.raises(TimeoutException):
+        make_probe_spider(tmp_path, [None]).count_results("q")
@@ -0,0 +1,105 @@
+import pickle
+import time
+
+from scopus.scopus_queue import WorkQueue
+from scopus.scopus_store import CheckpointStore
+
+
+def test_store_persists_records_and_cursor(tmp_path):
+    path = str(tmp_path / "checkpoint.db")
+    store = CheckpointStore(path, batch_size=2)
+    store.put(0, "2-s2.0-1", {"doi": "10.1/a"})
+    store.put(1, None, {"doi": "10.1/b"})
+    store.put(2, "2-s2.0-3", {"doi": "10.1/c"})
+    store.save_cursor("q", 0, 3)
+    store.put_plumx_id("2-s2.0-1", "42")
+    store.close()
+
+    store = CheckpointStore(path)
+    assert len(store) == 3
+    assert store.is_done(2) and not store.is_done(3)
+    assert store.has_eid("2-s2.0-3")
+    assert store.get(1) == {"doi": "10.1/b"}
+    assert store.get_by_eid("2-s2.0-1") == {"doi": "10.1/a"}
+    assert [idx for idx, _, _ in store.iter_records(batch=2)] == [0, 1, 2]
+    assert store.load_cursor("q") == {"query": "q", "page": 0, "total": 3}
+    assert store.load_cursor("other") is None
+    assert store.get_plumx_id("2-s2.0-1") == "42"
+    store.close()
+
+
+def test_store_imports_legacy_pickles_once(tmp_path):
+    pickles = tmp_path / "pickles"
+    pickles.mkdir()
+    for i in range(3):
+        with open(str(pickles / (str(i) + ".pickle")), "wb") as f:
+            pickle.dump({"doi": str(i)}, f)
+    store = CheckpointStore(str(tmp_path / "checkpoint.db"))
+    assert store.import_pickles(str(pickles)) == 3
+    with open(str(pickles / "3.pickle"), "wb") as f:
+        pickle.dump({"doi": "3"}, f)
+    assert store.import_pickles(str(pickles)) == 0
+    assert store.import_pickles(str(pickles), force=True) == 1
+    assert len(store) == 4
+    store.close()
+
+
+def test_queue_lease_expiry_and_results(tmp_path):
+    path = str(tmp_path / "queue.db")
+    wq = WorkQueue(path, lease_seconds=0.2, max_attempts=2)
+    assert wq.add([(0, "2-s2.0-1", "a", ""), (1, "", "b", "10.1/b"), (2, "", "c", "")]) == 2
+    assert len(wq.claim("a", 10)) == 2
+    assert wq.claim("b", 10) == []
+    time.sleep(0.25)
+    tasks = wq.claim("b", 10)
+    assert [t[0] for t in tasks] == [0, 1]
+    # 租约已被收回, 原来的owner上报无效
+    wq.complete("2-s2.0-1", "a", {"doi": "x"})
+    assert wq.counts() == {"leased": 2}
+    wq.complete("2-s2.0-1", "b", {"doi": "10.1/a"})
+    wq.fail("10.1/b", "b")
+    assert wq.counts() == {"done": 1, "failed": 1}
+    assert list(wq.iter_results()) == [(0, "2-s2.0-1", {"doi": "10.1/a"})]
+    wq.close()
+
+
+def test_queue_failed_task_returns_until_max_attempts(tmp_path):
+    wq = WorkQueue(str(tmp_path / "queue.db"), max_attempts=3)
+    wq.add([(0, "2-s2.0-1", "a", "")])
+    for _ in range(2):
+        assert len(wq.claim("w")) == 1
+        wq.fail("2-s2.0-1", "w")
+    assert wq.counts() == {"pending": 1}
+    wq.claim("w")
+    wq.fail("2-s2.0-1", "w")
+    assert wq.counts() == {"failed": 1}
+    wq.close()
+
+
+def test_queue_results_with_repeated_indices(tmp_path):
+    wq = WorkQueue(str(tmp_path / "queue.db"))
+    # 两个列表文件的行号都从0开始
+    wq.add([(i, "2-s2.0-a" + str(i), "", "") for i in range(3)])
+    wq.add([(i, "2-s2.0-b" + str(i), "", "") for i in range(3)])
+    for _, eid, _, _ in wq.claim("w", 10):
+        wq.complete(eid, "w", {"eid": eid})
+    assert len(list(wq.iter_results(batch=2))) == 6
+    wq.close()
+
+
+def test_store_keyed_records_do_not_collide_with_indices(tmp_path):
+    store = CheckpointStore(str(tmp_path / "checkpoint.db"))
+    store.put(5, "2-s2.0-1", {"doi": "10.1/page"})
+    store.put_keyed("2-s2.0-2", "2-s2.0-2", {"doi": "10.1/a"})
+    store.put_keyed("10.1/b", "", {"doi": "10.1/b"})
+    store.flush()
+    assert store.get(5) == {"doi": "10.1/page"}
+    assert store.has_key("2-s2.0-2") and store.has_key("10.1/b")
+    assert store.get_by_eid("2-s2.0-2") == {"doi": "10.1/a"}
+    assert store.get_keyed("10.1/b") == {"doi": "10.1/b"}
+    assert len(list(store)) == 3
+    store.close()
+
+    store = CheckpointStore(str(tmp_path / "checkpoint.db"))
+    assert store.has_key("10.1/b") and len(store) == 1
+    store.close()